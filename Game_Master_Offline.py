@@ -5,17 +5,27 @@
  See the test function at the end for how to customize
  the runs: choice of games and agents.
 
+ For many games at once, without output, see run_batch and
+ HeadlessGame near the end, or run e.g.
+   python Game_Master_Offline.py --games TTT FIAR -n 100
+
 (C) University of Washington and S. Tanimoto, 2025.
 
 '''
 
-from time import sleep
+from time import sleep, perf_counter
+import argparse
+import importlib
+import io
+import json
+import sys
+from contextlib import redirect_stdout
 USE_HTML = True
 if USE_HTML: import gameToHTML
 
 from winTesterForK import winTesterForK
 
-from game_types import TTT, FIAR, Cassini
+from game_types import State, TTT, FIAR, Cassini
 
 TIME_PER_MOVE = 1.0 # In seconds
 INITIAL_STATE = TTT.initial_state
@@ -194,6 +204,220 @@ def test():
     print("Players will play in DEMO mode (the default).")
     runGame()
 
+# Headless batch play: many games across agent pairings and game types,
+# with no printing, sleeping or HTML, and every game's state kept in its
+# own HeadlessGame object rather than in the globals above.
+
+class AgentSpec:
+    '''Which agent to play: an agent module (with an OurAgent class),
+    whether to make it the twin, and extra keyword arguments for each of
+    its make_move calls. Written on the command line as
+    module[:twin][:{"json": "make_move options"}].'''
+    def __init__(self, module_name, twin=False, move_options=None):
+        self.module_name = module_name
+        self.twin = twin
+        self.move_options = move_options or {}
+
+    @classmethod
+    def parse(cls, text):
+        # The JSON may itself hold colons, so it is split off first.
+        module_name, _, rest = text.partition(':')
+        twin = False
+        if not rest.startswith('{'):
+            flag, _, rest = rest.partition(':')
+            twin = flag == 'twin'
+        options = json.loads(rest) if rest else None
+        return cls(module_name, twin, options)
+
+    @property
+    def label(self):
+        label = self.module_name
+        if self.twin: label += ':twin'
+        if self.move_options: label += ':' + json.dumps(self.move_options, sort_keys=True)
+        return label
+
+    def create(self):
+        module = importlib.import_module(self.module_name)
+        return module.OurAgent(twin=self.twin)
+
+class GameRecord:
+    '''Outcome of one headless game. winner is 'X', 'O' or None for a
+    draw; moves and move_times list (side, move) and (side, seconds) in
+    the order played.'''
+    def __init__(self, game_type, x_label, o_label):
+        self.game_type = game_type.short_name
+        self.x_label = x_label
+        self.o_label = o_label
+        self.winner = None
+        self.reason = ''
+        self.moves = []
+        self.move_times = []
+
+    def label_of(self, side):
+        return self.x_label if side=='X' else self.o_label
+
+class HeadlessGame:
+    '''One game between two agents, played without output.'''
+    def __init__(self, game_type, x_spec, o_spec, time_per_move=None):
+        self.game_type = game_type
+        self.specs = {'X': x_spec, 'O': o_spec}
+        if time_per_move is None:
+            time_per_move = game_type.default_time_per_move
+        self.time_per_move = time_per_move
+        self.state = State(old=game_type.initial_state)
+        self.record = GameRecord(game_type, x_spec.label, o_spec.label)
+
+    def _forfeit(self, side, reason):
+        self.record.winner = 'O' if side=='X' else 'X'
+        self.record.reason = reason
+        return self.record
+
+    def _on_board(self, move):
+        # True if move is an (r, c) pair of ints inside the board.
+        if not isinstance(move, (tuple, list)) or len(move)!=2:
+            return False
+        r, c = move
+        if not isinstance(r, int) or not isinstance(c, int):
+            return False
+        return 0 <= r < self.game_type.n and 0 <= c < self.game_type.m
+
+    def play(self):
+        quiet = io.StringIO()
+        players = {}
+        for side, other in (('X', 'O'), ('O', 'X')):
+            try:
+                with redirect_stdout(quiet):
+                    players[side] = self.specs[side].create()
+                    players[side].prepare(self.game_type, side,
+                                          self.specs[other].label,
+                                          self.time_per_move,
+                                          utterances_matter=False)
+            except Exception as e:
+                return self._forfeit(side, side+' failed to prepare: '+repr(e))
+        remark = "The game is starting."
+        for turn in range(self.game_type.turn_limit):
+            side = self.state.whose_move
+            spec = self.specs[side]
+            start = perf_counter()
+            try:
+                with redirect_stdout(quiet):
+                    result = players[side].make_move(self.state, remark,
+                                                     self.time_per_move,
+                                                     **spec.move_options)
+            except Exception as e:
+                return self._forfeit(side, side+' raised '+repr(e))
+            finally:
+                quiet.seek(0); quiet.truncate()
+            self.record.move_times.append((side, perf_counter() - start))
+            move_and_state, remark = result
+            if move_and_state is None:
+                return self._forfeit(side, side+' made no move')
+            move = move_and_state[0]
+            if not self._on_board(move):
+                return self._forfeit(side, side+' played a malformed move '+repr(move))
+            r, c = move
+            if self.state.board[r][c] != ' ':
+                return self._forfeit(side, side+' played an illegal move '+str(move))
+            move = (r, c)
+            self.record.moves.append((side, move))
+            # The move is applied here; the agent's own new state is not trusted.
+            new_state = State(old=self.state)
+            new_state.board[r][c] = side
+            new_state.change_turn()
+            self.state = new_state
+            if winTesterForK(self.state, move, self.game_type.k) != "No win":
+                self.record.winner = side
+                self.record.reason = 'k in a row'
+                return self.record
+        self.record.reason = 'turn limit'
+        return self.record
+
+class BatchResults:
+    '''Win/draw/loss counts and per-move timings over many GameRecords.'''
+    def __init__(self):
+        self.records = []
+        self.wdl = {} # (game, agent, opponent) -> [wins, draws, losses]
+        self.times = {} # (game, agent) -> list of make_move seconds
+
+    def add(self, record):
+        self.records.append(record)
+        for side, other in (('X', 'O'), ('O', 'X')):
+            if side=='O' and record.x_label==record.o_label:
+                break # an agent against itself: the game counts once, for X
+            key = (record.game_type, record.label_of(side), record.label_of(other))
+            counts = self.wdl.setdefault(key, [0, 0, 0])
+            if record.winner is None: counts[1] += 1
+            elif record.winner==side: counts[0] += 1
+            else: counts[2] += 1
+        for side, seconds in record.move_times:
+            self.times.setdefault((record.game_type, record.label_of(side)), []).append(seconds)
+
+    def timing_stats(self):
+        stats = {}
+        for key, seconds in self.times.items():
+            ordered = sorted(seconds)
+            stats[key] = {'moves': len(ordered),
+                          'mean': sum(ordered) / len(ordered),
+                          'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                          'max': ordered[-1]}
+        return stats
+
+    def report(self):
+        lines = ['Game        Agent vs. Opponent: W / D / L']
+        for (game, agent, opponent), (w, d, l) in sorted(self.wdl.items()):
+            lines.append(f'{game:<11} {agent} vs. {opponent}: {w} / {d} / {l}')
+        lines.append('')
+        lines.append('Game        Agent: moves, mean / p95 / max seconds per move')
+        for (game, agent), st in sorted(self.timing_stats().items()):
+            lines.append(f"{game:<11} {agent}: {st['moves']}, "
+                         f"{st['mean']:.4f} / {st['p95']:.4f} / {st['max']:.4f}")
+        return '\n'.join(lines)
+
+def pairings(agent_specs):
+    # Every ordered pair of different agents, so each plays both sides;
+    # a single agent plays itself.
+    if len(agent_specs)==1:
+        return [(agent_specs[0], agent_specs[0])]
+    return [(x, o) for x in agent_specs for o in agent_specs if x is not o]
+
+def run_batch(agent_specs, game_types, games_per_pairing,
+              time_per_move=None, on_record=None):
+    results = BatchResults()
+    for game_type in game_types:
+        for x_spec, o_spec in pairings(agent_specs):
+            for i in range(games_per_pairing):
+                record = HeadlessGame(game_type, x_spec, o_spec, time_per_move).play()
+                results.add(record)
+                if on_record is not None: on_record(record)
+    return results
+
+GAME_TYPES_BY_NAME = {'TTT': TTT, 'FIAR': FIAR, 'Cassini': Cassini}
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Play many headless games and report W/D/L and move times.')
+    parser.add_argument('--agents', nargs='+', default=['twu29_KInARow'],
+                        help='agent specs: module[:twin][:{json make_move options}]')
+    parser.add_argument('--games', nargs='+', default=['TTT'],
+                        choices=sorted(GAME_TYPES_BY_NAME))
+    parser.add_argument('-n', '--games-per-pairing', type=int, default=10)
+    parser.add_argument('--time', type=float, default=None,
+                        help='seconds per move (default: the game type\'s own)')
+    parser.add_argument('--json', default=None,
+                        help='also write every game record to this file')
+    args = parser.parse_args(argv)
+    specs = [AgentSpec.parse(text) for text in args.agents]
+    game_types = [GAME_TYPES_BY_NAME[name] for name in args.games]
+    results = run_batch(specs, game_types, args.games_per_pairing, args.time)
+    print(results.report())
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([vars(record) for record in results.records], f)
+    return results
+
 if __name__ == '__main__':
-    test()
+    if len(sys.argv) > 1:
+        batch_main()
+    else:
+        test()
     
@@ -0,0 +1,252 @@
+'''benchmark.py
+
+Search benchmarks for twu29_KInARow.OurAgent. Every configuration in
+CONFIGS searches every position in CORPUS to the position's depth, with
+no time limit, so node counts come out the same on every run. For each
+pair it records nodes, static evals, cutoffs, nodes per second and the
+move chosen. The root-parallel search's nodes are visited in its worker
+processes, out of the profiler's sight, so 'parallel' records 0 nodes;
+its static evals and cutoffs are summed from the workers.
+
+The results are checked against benchmark_baseline.json. A search that
+needs more nodes or static evals than the baseline, or chooses another
+move, is a regression: it is listed and the run exits with status 1.
+Nodes per second depend on the machine, so they are only compared when
+--min-speed is given.
+
+Usage:
+    python benchmark.py                    # check against the baseline
+    python benchmark.py --update           # write a new baseline
+    python benchmark.py --game FIAR --config ab ordered_ab
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from game_types import State, TTT, FIAR, Cassini
+import twu29_KInARow as agent_module
+
+GAME_TYPES = {'TTT': TTT, 'FIAR': FIAR, 'Cassini': Cassini}
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark_baseline.json')
+
+# name: (game, moves played from the initial state, search depth)
+CORPUS = {
+    'TTT-mid': ('TTT', [(0, 0), (1, 1), (2, 2)], 6),
+    'TTT-end': ('TTT', [(0, 0), (1, 1), (0, 2), (0, 1), (2, 1)], 4),
+    'FIAR-mid': ('FIAR', [(2, 3), (3, 2), (4, 3), (3, 3), (3, 4), (1, 2), (2, 5),
+                          (5, 2), (2, 2), (2, 4)], 3),
+    'FIAR-end': ('FIAR', [(5, 4), (5, 3), (0, 4), (0, 3), (1, 5), (2, 3), (6, 3),
+                          (4, 3), (1, 3), (4, 2), (1, 4), (3, 0), (1, 2), (1, 1),
+                          (5, 0), (0, 5), (4, 0), (1, 6), (3, 1), (1, 0), (5, 2),
+                          (3, 4)], 3),
+    'Cassini-mid': ('Cassini', [(0, 3), (5, 7), (0, 5), (2, 6), (0, 4), (0, 2),
+                                (5, 2), (3, 6), (4, 5), (4, 6)], 3),
+    'Cassini-end': ('Cassini', [(0, 3), (1, 3), (0, 4), (1, 4), (0, 2), (1, 2),
+                                (0, 5), (5, 3), (3, 7), (4, 7), (5, 2), (2, 1),
+                                (4, 6), (6, 7), (0, 7), (0, 1), (5, 1), (1, 6),
+                                (3, 1), (4, 5), (4, 2), (6, 4)], 3),
+}
+
+_FAST = dict(use_incremental_eval=True, use_make_unmake=True,
+             use_win_detection=True, move_radius=2)
+
+# name: make_move options
+CONFIGS = {
+    'no_ab': dict(use_alpha_beta=False, use_move_ordering=False),
+    'ab': dict(use_move_ordering=False),
+    'ordered_ab': dict(),
+    'tt': dict(use_zobrist_hashing=True),
+    'incremental': dict(use_incremental_eval=True, use_make_unmake=True),
+    'batch_eval': dict(use_batch_eval=True),
+    'frontier': dict(_FAST),
+    'bitboards': dict(_FAST, use_bitboards=True),
+    'dynamic_ordering': dict(_FAST, use_dynamic_ordering=True),
+    'pvs': dict(_FAST, use_pvs=True),
+    'threat_search': dict(_FAST, use_threat_search=True),
+    'symmetry': dict(_FAST, use_zobrist_hashing=True, use_symmetry=True),
+    'full': dict(_FAST, use_zobrist_hashing=True, use_pvs=True,
+                 use_iterative_deepening=True),
+    # 'full' with killer/history ordering in place of static_eval ordering
+    'full_dynamic': dict(_FAST, use_zobrist_hashing=True, use_dynamic_ordering=True,
+                         use_pvs=True, use_iterative_deepening=True),
+    'parallel': dict(_FAST, use_zobrist_hashing=True, use_parallel_search=True),
+    'endgame': dict(_FAST, use_endgame_solver=True),
+    'position_cache': dict(_FAST, use_zobrist_hashing=True, use_position_cache=True),
+}
+
+# Environment the agent is prepared with, per configuration. A
+# directory of None is a new temporary directory for each search, so no
+# run sees what an earlier one stored.
+CONFIG_ENV = {
+    'parallel': {'A4_SEARCH_WORKERS': '2'},
+    'position_cache': {'A4_POSITION_CACHE': None},
+}
+
+# The measures that must not grow.
+CHECKED = ('nodes', 'static_evals')
+
+def position(name):
+    game_name, moves, depth = CORPUS[name]
+    game_type = GAME_TYPES[game_name]
+    state = State(old=game_type.initial_state)
+    for r, c in moves:
+        state.board[r][c] = state.whose_move
+        state.change_turn()
+    return game_type, state, depth
+
+class _Records:
+    # SearchProfiler sink that keeps the records.
+    def __init__(self):
+        self.records = []
+
+    def write(self, line):
+        self.records.append(json.loads(line))
+
+@contextlib.contextmanager
+def _environment(variables):
+    # Sets variables (a None value: a new temporary directory) and
+    # restores the old values afterwards.
+    saved = {name: os.environ.get(name) for name in variables}
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            for name, value in variables.items():
+                os.environ[name] = directory if value is None else value
+            yield
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+def _search(game_type, state, depth, options, profile, env=None):
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()), _environment(env or {}):
+        agent.prepare(game_type, state.whose_move, 'Benchmark', utterances_matter=False)
+        sink = _Records()
+        if profile:
+            agent.profiler = agent_module.SearchProfiler(sink)
+        start = time.perf_counter()
+        result, _remark = agent.make_move(State(old=state), '', time_limit=None,
+                                          max_ply=depth, **options)
+        seconds = time.perf_counter() - start
+        agent.shutdown_search_pool()
+        if agent.position_cache is not None:
+            # written now, while its temporary directory is still there
+            agent.save_position_cache()
+            agent.position_cache.close()
+    return agent, result[0], seconds, sink.records
+
+def run_one(position_name, config_name):
+    # Searches once with the profiler, for the node count, and once
+    # without, for the time.
+    game_type, state, depth = position(position_name)
+    options = CONFIGS[config_name]
+    env = CONFIG_ENV.get(config_name)
+    agent, move, _seconds, records = _search(game_type, state, depth, options, True, env)
+    _agent, _move, seconds, _records = _search(game_type, state, depth, options, False, env)
+    nodes = records[0]['nodes']
+    return {'move': list(move),
+            'nodes': nodes,
+            'static_evals': agent.num_static_evals_this_turn,
+            'cutoffs': agent.alpha_beta_cutoffs_this_turn,
+            'seconds': round(seconds, 4),
+            'nps': round(nodes / seconds) if seconds > 0 else None}
+
+def run(position_names, config_names, verbose=True):
+    results = {}
+    for position_name in position_names:
+        for config_name in config_names:
+            result = run_one(position_name, config_name)
+            results[position_name + '/' + config_name] = result
+            if verbose:
+                print(f"{position_name:12} {config_name:17} move {tuple(result['move'])}"
+                      f" nodes {result['nodes']:8} evals {result['static_evals']:8}"
+                      f" cutoffs {result['cutoffs']:7} nps {result['nps']:8}"
+                      f" ({result['seconds']:.3f}s)")
+    return results
+
+# Compares results with baseline. Returns the list of regressions, each
+# a line of text; nodes per second only count if min_speed (a fraction
+# of the baseline's) is given.
+def compare(results, baseline, tolerance=0.0, min_speed=None):
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key}: not in the baseline")
+            continue
+        if result['move'] != base['move']:
+            regressions.append(f"{key}: move {tuple(result['move'])}, "
+                               f"baseline {tuple(base['move'])}")
+        for measure in CHECKED:
+            if result[measure] > base[measure] * (1 + tolerance):
+                regressions.append(f"{key}: {measure} {result[measure]}, "
+                                   f"baseline {base[measure]}")
+        if min_speed is not None and base.get('nps') and result['nps'] is not None \
+                and result['nps'] < base['nps'] * min_speed:
+            regressions.append(f"{key}: {result['nps']} nodes/s, "
+                               f"baseline {base['nps']}")
+    return regressions
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as f:
+        return json.load(f)['results']
+
+def save_baseline(results, path=BASELINE_PATH):
+    # New results are merged into the ones already there.
+    try:
+        merged = load_baseline(path)
+    except (OSError, ValueError, KeyError):
+        merged = {}
+    merged.update(results)
+    with open(path, 'w') as f:
+        json.dump({'corpus': {name: [game, moves, depth]
+                              for name, (game, moves, depth) in CORPUS.items()},
+                   'results': dict(sorted(merged.items()))}, f, indent=1)
+        f.write('\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--game', nargs='+', choices=sorted(GAME_TYPES),
+                        help='only the positions of these games')
+    parser.add_argument('--position', nargs='+', choices=list(CORPUS))
+    parser.add_argument('--config', nargs='+', choices=list(CONFIGS))
+    parser.add_argument('--update', action='store_true',
+                        help='write the results to the baseline instead of checking them')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='allowed growth of nodes and static evals, as a fraction')
+    parser.add_argument('--min-speed', type=float, default=None,
+                        help='fail below this fraction of the baseline nodes/s')
+    args = parser.parse_args(argv)
+
+    position_names = args.position or list(CORPUS)
+    if args.game:
+        position_names = [name for name in position_names if CORPUS[name][0] in args.game]
+    results = run(position_names, args.config or list(CONFIGS))
+
+    if args.update:
+        save_baseline(results, args.baseline)
+        print(f"Wrote {len(results)} results to {args.baseline}")
+        return 0
+    regressions = compare(results, load_baseline(args.baseline),
+                          args.tolerance, args.min_speed)
+    if regressions:
+        print(f"\n{len(regressions)} REGRESSION(S) against {args.baseline}:")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print(f"\nNo regressions against {args.baseline}.")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
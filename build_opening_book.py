@@ -0,0 +1,103 @@
+'''build_opening_book.py
+
+Builds the opening books read by twu29_KInARow.OurAgent (see OpeningBook
+there). For one Game_Type it visits every position reachable in the
+first few plies, folds positions that are mirror images or rotations of
+each other into one, runs a deep search on each and writes the best
+moves to opening_book_<game>.bin next to the agent.
+
+Usage:
+    python build_opening_book.py TTT --plies 9
+    python build_opening_book.py FIAR --plies 2 --time 5
+'''
+
+import argparse
+import contextlib
+import io
+import time
+
+from game_types import State, TTT, FIAR, Cassini
+import twu29_KInARow as agent_module
+
+GAME_TYPES = {'TTT': TTT, 'FIAR': FIAR, 'Cassini': Cassini}
+
+# Search settings used for every book position, searched as deep as
+# seconds_per_position allows.
+SEARCH_OPTIONS = dict(use_iterative_deepening=True,
+                      max_ply=None,
+                      use_zobrist_hashing=True,
+                      use_incremental_eval=True,
+                      use_make_unmake=True,
+                      use_win_detection=True,
+                      use_threat_search=True,
+                      move_radius=2)
+
+def book_positions(game_type, plies, book):
+    # Positions with 0 .. plies-1 moves played, one per symmetry class,
+    # in the order they are reached.
+    positions = []
+    seen = set()
+    frontier = [game_type.initial_state]
+    for ply in range(plies):
+        next_frontier = []
+        for state in frontier:
+            h, _t = book.canonical_hash(state)
+            if h in seen:
+                continue
+            seen.add(h)
+            positions.append(state)
+            if ply == plies - 1:
+                continue
+            for r, row in enumerate(state.board):
+                for c, cell in enumerate(row):
+                    if cell == ' ':
+                        child = State(old=state)
+                        child.board[r][c] = state.whose_move
+                        child.change_turn()
+                        if not agent_module.wins_through(child.board, r, c, game_type.k):
+                            next_frontier.append(child)
+        frontier = next_frontier
+    return positions
+
+def build(game_type, plies, seconds_per_position, path=None, verbose=True):
+    book = agent_module.OpeningBook(game_type)
+    positions = book_positions(game_type, plies, book)
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(game_type, 'X', 'Book builder', utterances_matter=False)
+    entries = {}
+    start = time.time()
+    for i, state in enumerate(positions):
+        if not any(' ' in row for row in state.board):
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            result, _remark = agent.make_move(state, '', seconds_per_position,
+                                              **SEARCH_OPTIONS)
+        move = result[0]
+        h, t = book.canonical_hash(state)
+        entries[h] = t[move[0]][move[1]]
+        if verbose:
+            print(f"{i + 1}/{len(positions)}: {move} "
+                  f"(depth {agent.completed_depth_this_turn}, "
+                  f"{time.time() - start:.0f}s so far)")
+    if path is None:
+        path = agent_module.opening_book_path(game_type)
+    book.save(path, entries)
+    if verbose:
+        print(f"Wrote {len(entries)} positions to {path}")
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('game', choices=sorted(GAME_TYPES))
+    parser.add_argument('--plies', type=int, default=2,
+                        help='book every position with fewer moves played')
+    parser.add_argument('--time', type=float, default=2.0,
+                        help='search time per position, in seconds')
+    parser.add_argument('--output', default=None,
+                        help='book file (default: where the agent looks)')
+    args = parser.parse_args()
+    build(GAME_TYPES[args.game], args.plies, args.time, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+# Lets pytest import the top-level modules (game_types, twu29_KInARow, ...)
+# from tests/.
@@ -50,6 +50,118 @@ class State:
 def deep_copy(board_data):
     return [row[:] for row in board_data]
 
+class BitboardState:
+    '''A K-in-a-Row position packed into three ints: bitmasks of the X
+    stones, the O stones and the forbidden squares.
+
+    Cell (r, c) is bit r*(m+1) + c. Every row has one spare guard bit
+    after its last column, so shifting a mask by 1, m, m+1 or m+2 moves
+    every stone one step along a row, anti-diagonal, column or diagonal
+    without wrapping onto the next row. A 7x8 board needs 63 bits.
+    '''
+    def __init__(self, n, m, x_bits=0, o_bits=0, forbidden_bits=0, whose_move="X"):
+        self.n = n
+        self.m = m
+        self.x_bits = x_bits
+        self.o_bits = o_bits
+        self.forbidden_bits = forbidden_bits
+        self.whose_move = whose_move
+
+    @classmethod
+    def from_state(cls, state):
+        n = len(state.board)
+        m = len(state.board[0])
+        bb = cls(n, m, whose_move=state.whose_move)
+        for r, row in enumerate(state.board):
+            for c, item in enumerate(row):
+                bit = 1 << (r*(m+1) + c)
+                if item=="X": bb.x_bits |= bit
+                elif item=="O": bb.o_bits |= bit
+                elif item=="-": bb.forbidden_bits |= bit
+        return bb
+
+    def to_state(self):
+        board = []
+        for r in range(self.n):
+            row = []
+            for c in range(self.m):
+                bit = self.bit(r, c)
+                if self.x_bits & bit: row.append("X")
+                elif self.o_bits & bit: row.append("O")
+                elif self.forbidden_bits & bit: row.append("-")
+                else: row.append(" ")
+            board.append(row)
+        return State(initial_state_data=[board, self.whose_move])
+
+    def copy(self):
+        return BitboardState(self.n, self.m, self.x_bits, self.o_bits,
+                             self.forbidden_bits, self.whose_move)
+
+    def bit(self, r, c):
+        return 1 << (r*(self.m+1) + c)
+
+    def board_bits(self):
+        # Mask of every on-board cell (guard bits excluded).
+        row = (1 << self.m) - 1
+        bits = 0
+        for r in range(self.n):
+            bits |= row << (r*(self.m+1))
+        return bits
+
+    def empty_bits(self):
+        return self.board_bits() & ~(self.x_bits | self.o_bits | self.forbidden_bits)
+
+    def place(self, r, c):
+        # Put a stone for whoever is to move at (r, c) and change turn.
+        if self.whose_move=="X": self.x_bits |= self.bit(r, c)
+        else: self.o_bits |= self.bit(r, c)
+        self.change_turn()
+
+    def change_turn(self):
+        if self.whose_move=="X": self.whose_move="O"
+        else: self.whose_move="X"
+
+    def toggle(self, r, c, player):
+        # Put player's stone at (r, c), or take it back if it is there.
+        # Whose move it is does not change (make/unmake search keeps track).
+        if player=="X": self.x_bits ^= self.bit(r, c)
+        else: self.o_bits ^= self.bit(r, c)
+
+    def completes_line(self, player, masks):
+        # True if player's stones fill one of masks, e.g. the masks of the
+        # k-in-a-row lines through the cell just played.
+        bits = self.x_bits if player=="X" else self.o_bits
+        for mask in masks:
+            if bits & mask == mask: return True
+        return False
+
+    def key(self):
+        # Hashable summary of the position.
+        return (self.x_bits, self.o_bits, self.whose_move)
+
+    def __eq__(self, other):
+        return (isinstance(other, BitboardState) and self.key()==other.key()
+                and self.forbidden_bits==other.forbidden_bits)
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def has_k_in_a_row(self, bits, k):
+        # True if the stones in bits include k in a line in any direction.
+        for shift in (1, self.m, self.m+1, self.m+2):
+            run = bits
+            for i in range(1, k):
+                run &= bits >> (i*shift)
+                if not run: break
+            if run: return True
+        return False
+
+    def winner(self, k):
+        # "X", "O" or None.
+        if self.has_k_in_a_row(self.x_bits, k): return "X"
+        if self.has_k_in_a_row(self.o_bits, k): return "O"
+        return None
+
 class Game_Type:
     def __init__(self, long_name, short_name, k, n, m, initial_state_data, turn_limit, default_time_per_move):
         self.long_name = long_name
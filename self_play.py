@@ -0,0 +1,81 @@
+'''self_play.py
+
+Self-play across worker processes. Independent games between an agent
+and its twin (by default, as in Game_Master_Offline.test) are spread
+over a process pool; every finished game is appended to a JSON-lines
+file as soon as it comes back, so long nightly runs can be stopped and
+inspected at any point.
+
+Each game gets its own seed (base seed + game number), set in the worker
+before the game starts, so the random fallback utterances and any
+random tie-breaking are reproducible game by game.
+
+Usage:
+    python self_play.py --game FIAR --games 1000 --out self_play.jsonl
+'''
+
+import argparse
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Game_Master_Offline import AgentSpec, HeadlessGame, GAME_TYPES_BY_NAME
+
+def play_one(game_name, x_spec_text, o_spec_text, time_per_move, seed):
+    # Runs in a worker process. Returns the game as a compact dict.
+    random.seed(seed)
+    game = HeadlessGame(GAME_TYPES_BY_NAME[game_name],
+                        AgentSpec.parse(x_spec_text),
+                        AgentSpec.parse(o_spec_text),
+                        time_per_move)
+    record = game.play()
+    return {'game': game_name,
+            'x': x_spec_text,
+            'o': o_spec_text,
+            'seed': seed,
+            'result': record.winner or 'draw',
+            'reason': record.reason,
+            'moves': [list(move) for _side, move in record.moves],
+            'times': [round(seconds, 4) for _side, seconds in record.move_times]}
+
+def self_play(game_name, num_games, out_path, x_spec_text='twu29_KInARow',
+              o_spec_text='twu29_KInARow:twin', time_per_move=None,
+              workers=None, base_seed=0):
+    # Plays num_games games and appends each record to out_path as it
+    # finishes. Returns the counts of X wins, O wins and draws.
+    totals = {'X': 0, 'O': 0, 'draw': 0}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, \
+         open(out_path, 'a') as out:
+        futures = [pool.submit(play_one, game_name, x_spec_text, o_spec_text,
+                               time_per_move, base_seed + i)
+                   for i in range(num_games)]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, separators=(',', ':')) + '\n')
+            out.flush()
+            totals[record['result']] += 1
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel self-play.')
+    parser.add_argument('--game', default='FIAR', choices=sorted(GAME_TYPES_BY_NAME))
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--out', default='self_play.jsonl')
+    parser.add_argument('--x', default='twu29_KInARow',
+                        help='agent spec for X, as in Game_Master_Offline')
+    parser.add_argument('--o', default='twu29_KInARow:twin',
+                        help='agent spec for O')
+    parser.add_argument('--time', type=float, default=None,
+                        help="seconds per move (default: the game type's own)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    args = parser.parse_args()
+    totals = self_play(args.game, args.games, args.out, args.x, args.o,
+                       args.time, args.workers, args.seed)
+    print(f"X wins {totals['X']}, O wins {totals['O']}, draws {totals['draw']}"
+          f" -> {args.out}")
+
+if __name__ == '__main__':
+    main()
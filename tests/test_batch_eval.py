@@ -0,0 +1,43 @@
+import contextlib
+import io
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from game_types import State, TTT, FIAR, Cassini
+import twu29_KInARow as agent_module
+from twu29_KInARow import BatchEvaluator
+
+
+def random_position(game_type, stones, rng):
+    state = State(old=game_type.initial_state)
+    cells = [(r, c) for r, row in enumerate(state.board)
+             for c, cell in enumerate(row) if cell == ' ']
+    for (r, c) in rng.sample(cells, stones):
+        state.board[r][c] = rng.choice('XO')
+    state.whose_move = rng.choice('XO')
+    return state
+
+
+@pytest.mark.parametrize('game_type', [TTT, FIAR, Cassini])
+def test_batch_scores_match_static_eval(game_type):
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(game_type, 'X', 'Tester', utterances_matter=False)
+    evaluator = BatchEvaluator(game_type)
+    rng = random.Random(13)
+    empty = sum(row.count(' ') for row in game_type.initial_state.board)
+    for trial in range(50):
+        state = random_position(game_type, rng.randrange(0, empty), rng)
+        [score] = evaluator.scores(evaluator.encode(state)[None, :]).tolist()
+        assert score == agent.static_eval(state)
+        moves = [(r, c) for r, row in enumerate(state.board)
+                 for c, cell in enumerate(row) if cell == ' ']
+        expected = []
+        for (r, c) in moves:
+            child = State(old=state)
+            child.board[r][c] = state.whose_move
+            expected.append(agent.static_eval(child))
+        assert evaluator.child_scores(state, moves) == expected
@@ -0,0 +1,69 @@
+import random
+
+from game_types import State, BitboardState, TTT, FIAR, Cassini
+import twu29_KInARow as agent_module
+
+
+def random_board(game_type, stones, rng):
+    state = State(old=game_type.initial_state)
+    cells = [(r, c) for r, row in enumerate(state.board)
+             for c, cell in enumerate(row) if cell == ' ']
+    for (r, c) in rng.sample(cells, stones):
+        state.board[r][c] = rng.choice('XO')
+    return state
+
+
+def has_line(board, piece, k):
+    # Brute force: any k-in-a-row of piece, in any direction.
+    n, m = len(board), len(board[0])
+    for r in range(n):
+        for c in range(m):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                cells = [(r + i * dr, c + i * dc) for i in range(k)]
+                if all(0 <= rr < n and 0 <= cc < m and board[rr][cc] == piece
+                       for (rr, cc) in cells):
+                    return True
+    return False
+
+
+def test_round_trip():
+    rng = random.Random(0)
+    for game_type in (TTT, FIAR, Cassini):
+        state = random_board(game_type, 10 if game_type is not TTT else 5, rng)
+        assert BitboardState.from_state(state).to_state().board == state.board
+
+
+def test_winner_matches_board():
+    rng = random.Random(1)
+    for game_type in (TTT, FIAR, Cassini):
+        empty = sum(row.count(' ') for row in game_type.initial_state.board)
+        for trial in range(200):
+            state = random_board(game_type, rng.randrange(empty + 1), rng)
+            bitboard = BitboardState.from_state(state)
+            for piece in 'XO':
+                bits = bitboard.x_bits if piece == 'X' else bitboard.o_bits
+                assert bitboard.has_k_in_a_row(bits, game_type.k) \
+                    == has_line(state.board, piece, game_type.k)
+
+
+def test_completes_line_matches_wins_through():
+    rng = random.Random(2)
+    for game_type in (TTT, FIAR, Cassini):
+        tables = agent_module.window_tables(game_type)
+        empty = sum(row.count(' ') for row in game_type.initial_state.board)
+        for trial in range(200):
+            state = random_board(game_type, rng.randrange(1, empty + 1), rng)
+            bitboard = BitboardState.from_state(state)
+            for r, row in enumerate(state.board):
+                for c, cell in enumerate(row):
+                    if cell in 'XO':
+                        assert bitboard.completes_line(cell, tables.cell_masks[r * game_type.m + c]) \
+                            == agent_module.wins_through(state.board, r, c, game_type.k)
+
+
+def test_toggle_places_and_takes_back():
+    bitboard = BitboardState.from_state(FIAR.initial_state)
+    bitboard.toggle(3, 3, 'O')
+    assert bitboard.to_state().board[3][3] == 'O'
+    bitboard.toggle(3, 3, 'O')
+    assert bitboard.key() == BitboardState.from_state(FIAR.initial_state).key()
@@ -0,0 +1,62 @@
+from game_types import State, Game_Type, TTT, TTT_INITIAL_STATE_DATA
+from twu29_KInARow import EndgameSolver, WIN_SCORE
+
+
+def ttt_state(rows, whose_move):
+    return State(initial_state_data=[[list(row) for row in rows], whose_move])
+
+
+def test_tic_tac_toe_is_a_draw():
+    value, move = EndgameSolver(TTT).solve(State(old=TTT.initial_state))
+    assert value == 0
+    assert move is not None
+
+
+def test_takes_the_win():
+    state = ttt_state(['XX ', 'OO ', '   '], 'X')
+    assert EndgameSolver(TTT).solve(state) == (WIN_SCORE - 5, (0, 2))
+    state.whose_move = 'O'
+    assert EndgameSolver(TTT).solve(state) == (-(WIN_SCORE - 5), (1, 2))
+
+
+def test_loses_to_a_fork():
+    # X threatens the top row and the main diagonal; O can block only one.
+    state = ttt_state(['X X', ' X ', 'O  '], 'O')
+    value, move = EndgameSolver(TTT).solve(state)
+    assert value == WIN_SCORE - 6
+    assert move in ((0, 1), (2, 2))
+
+
+def test_turn_limit_is_a_draw():
+    short = Game_Type("Short Tic-Tac-Toe", "TTT4", 3, 3, 3, TTT_INITIAL_STATE_DATA, 4, 1)
+    state = ttt_state(['XX ', 'OO ', '   '], 'X')
+    assert EndgameSolver(short).solve(state) == (0, None)
+
+
+def test_file_is_read_back_and_compacted(tmp_path):
+    path = str(tmp_path / 'endgame.txt')
+    state = State(old=TTT.initial_state)
+    solver = EndgameSolver(TTT, path)
+    expected = solver.solve(state)
+    solver.flush()
+    with open(path) as f:
+        lines = f.read().splitlines()
+    with open(path, 'a') as f:
+        f.write('\n'.join(lines) + '\nnot a line\n')
+    again = EndgameSolver(TTT, path)
+    assert again.solve(state) == expected
+    assert again.nodes == 0
+    with open(path) as f:
+        assert sorted(f.read().splitlines()) == sorted(lines)
+
+
+def test_memo_is_bounded(tmp_path):
+    path = str(tmp_path / 'endgame.txt')
+    state = State(old=TTT.initial_state)
+    solver = EndgameSolver(TTT, path, max_entries=100)
+    assert solver.solve(state)[0] == 0
+    assert len(solver.solved) == 100
+    solver.flush()
+    assert len(EndgameSolver(TTT, path, max_entries=100).solved) == 100
+    with open(path) as f:
+        assert len(f.readlines()) == 100
@@ -0,0 +1,91 @@
+import sys
+import types
+
+import pytest
+
+from game_types import TTT
+from Game_Master_Offline import AgentSpec, BatchResults, GameRecord, HeadlessGame
+
+
+class ScriptedAgent:
+    # Plays the moves in MOVES in order, whatever the board.
+    MOVES = []
+
+    def __init__(self, twin=False):
+        self.moves = list(self.MOVES)
+
+    def prepare(self, *args, **kwargs):
+        return "OK"
+
+    def make_move(self, state, remark, time_limit, **kwargs):
+        return [[self.moves.pop(0), state], "OK"]
+
+
+def scripted_module(name, moves):
+    module = types.ModuleType(name)
+    module.OurAgent = type('OurAgent', (ScriptedAgent,), {'MOVES': moves})
+    sys.modules[name] = module
+    return AgentSpec(name)
+
+
+def play(x_moves, o_moves):
+    x_spec = scripted_module('scripted_x', x_moves)
+    o_spec = scripted_module('scripted_o', o_moves)
+    return HeadlessGame(TTT, x_spec, o_spec, time_per_move=1.0).play()
+
+
+def test_out_of_bounds_move_forfeits():
+    record = play([(3, 0)], [])
+    assert record.winner == 'O'
+    assert 'malformed' in record.reason
+
+
+def test_negative_index_forfeits():
+    record = play([(-1, 0)], [])
+    assert record.winner == 'O'
+
+
+def test_malformed_move_forfeits():
+    record = play([(1, 1)], [(0,)])
+    assert record.winner == 'X'
+    assert 'malformed' in record.reason
+
+
+def test_occupied_square_forfeits():
+    record = play([(1, 1)], [(1, 1)])
+    assert record.winner == 'X'
+    assert 'illegal' in record.reason
+
+
+def test_agent_state_is_not_trusted():
+    # The agents hand back the unchanged state; the game still advances
+    # and X wins along the top row.
+    record = play([(0, 0), (0, 1), (0, 2)], [(1, 0), (1, 1)])
+    assert record.winner == 'X'
+    assert record.reason == 'k in a row'
+
+
+@pytest.mark.parametrize('text, twin, options', [
+    ('twu29_KInARow', False, {}),
+    ('twu29_KInARow:twin', True, {}),
+    ('twu29_KInARow:{"max_ply": 2}', False, {'max_ply': 2}),
+    ('twu29_KInARow::{"max_ply": 2}', False, {'max_ply': 2}),
+    ('twu29_KInARow:twin:{"max_ply": 2, "move_radius": 1}', True,
+     {'max_ply': 2, 'move_radius': 1}),
+])
+def test_agent_spec_round_trip(text, twin, options):
+    spec = AgentSpec.parse(text)
+    assert (spec.module_name, spec.twin, spec.move_options) == ('twu29_KInARow', twin, options)
+    again = AgentSpec.parse(spec.label)
+    assert (again.module_name, again.twin, again.move_options) == ('twu29_KInARow', twin, options)
+
+
+def test_self_play_game_counts_once():
+    results = BatchResults()
+    record = GameRecord(TTT, 'agent', 'agent')
+    results.add(record)
+    assert results.wdl == {('TTT', 'agent', 'agent'): [0, 1, 0]}
+    record = GameRecord(TTT, 'agent', 'agent')
+    record.winner = 'O'
+    results.add(record)
+    assert results.wdl == {('TTT', 'agent', 'agent'): [0, 1, 1]}
@@ -0,0 +1,73 @@
+import contextlib
+import io
+import random
+
+import pytest
+
+from game_types import State, TTT, FIAR, Cassini
+import twu29_KInARow as agent_module
+from twu29_KInARow import IncrementalEvaluator
+
+
+@pytest.mark.parametrize('game_type', [TTT, FIAR, Cassini])
+def test_incremental_score_matches_static_eval(game_type):
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(game_type, 'X', 'Tester', utterances_matter=False)
+    rng = random.Random(3)
+    for game in range(20):
+        state = State(old=game_type.initial_state)
+        evaluator = IncrementalEvaluator(game_type)
+        evaluator.load(state)
+        placed = []
+        for step in range(60):
+            empty = [(r, c) for r, row in enumerate(state.board)
+                     for c, cell in enumerate(row) if cell == ' ']
+            if placed and (not empty or rng.random() < 0.35):
+                # take back the last stone, as the search does
+                r, c, piece = placed.pop()
+                state.board[r][c] = ' '
+                evaluator.remove(r, c, piece)
+            else:
+                r, c = rng.choice(empty)
+                piece = rng.choice('XO')
+                state.board[r][c] = piece
+                evaluator.place(r, c, piece)
+                placed.append((r, c, piece))
+            assert evaluator.score == agent.static_eval(state)
+
+
+def random_position(game_type, stones, rng):
+    state = State(old=game_type.initial_state)
+    cells = [(r, c) for r, row in enumerate(state.board)
+             for c, cell in enumerate(row) if cell == ' ']
+    for (r, c) in rng.sample(cells, stones):
+        state.board[r][c] = state.whose_move
+        state.change_turn()
+    return state
+
+
+def search_value(agent, state, depth, **options):
+    agent._begin_search(state, **options)
+    agent._root_depth = depth
+    root = agent._work_state if agent._work_state is not None else State(old=state)
+    try:
+        return agent.minimax(root, depth_remaining=depth, pruning=True,
+                             alpha=-float('inf'), beta=float('inf'), order_children=True)
+    finally:
+        agent._end_search()
+
+
+@pytest.mark.parametrize('game_type', [TTT, FIAR, Cassini])
+def test_incremental_search_matches_plain_alpha_beta(game_type):
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(game_type, 'X', 'Tester', utterances_matter=False)
+    rng = random.Random(game_type.k)
+    empty = sum(row.count(' ') for row in game_type.initial_state.board)
+    for trial in range(12):
+        state = random_position(game_type, rng.randrange(0, min(empty - 2, 12)), rng)
+        plain = search_value(agent, state, 2)
+        assert search_value(agent, state, 2, use_incremental_eval=True) == plain
+        assert search_value(agent, state, 2, use_incremental_eval=True,
+                            use_make_unmake=True) == plain
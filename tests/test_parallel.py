@@ -0,0 +1,84 @@
+import contextlib
+import io
+import time
+from concurrent.futures import Future
+
+from game_types import State, FIAR
+import twu29_KInARow as agent_module
+from benchmark import position
+
+OPTIONS = dict(use_zobrist_hashing=True, use_incremental_eval=True, use_make_unmake=True,
+               use_win_detection=True, move_radius=2)
+
+
+def test_tasks_of_one_turn_share_a_table_generation():
+    game_type, state, _depth = position('FIAR-mid')
+    agent = agent_module.OurAgent()
+    agent.current_game_type = game_type
+    moves = [(3, 5), (4, 2), (1, 3)]
+    for turn_id in (1, 1, 1, 2, 2):
+        for move in moves:
+            agent._search_subtree(State(old=state), move, 3, True, -float('inf'),
+                                  float('inf'), None, OPTIONS, turn_id)
+        if turn_id == 1:
+            assert agent.zobrist_table.generation == 1
+    assert agent.zobrist_table.generation == 2
+
+
+class InlinePool:
+    # Runs each task at once, in this process, and records its window.
+    def __init__(self):
+        self.windows = []
+
+    def submit(self, fn, *args):
+        self.windows.append(args[5:7])
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, **kwargs):
+        pass
+
+
+def test_parallel_root_honours_the_aspiration_window():
+    game_type, state, _depth = position('Cassini-mid')
+    serial = []
+    for parallel in (False, True):
+        agent = agent_module.OurAgent()
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent.prepare(game_type, state.whose_move, 'Tester', utterances_matter=False)
+            if parallel:
+                agent_module._init_search_worker(game_type)
+                agent._search_pool = pool = InlinePool()
+            result, _remark = agent.make_move(
+                State(old=state), '', time_limit=None, max_ply=3,
+                use_iterative_deepening=True, aspiration_window=50,
+                use_parallel_search=parallel, **OPTIONS)
+        serial.append((result[0], agent.aspiration_re_searches_this_turn))
+    assert serial[0] == serial[1]
+    # after depth 1, the first root move of each iteration is searched
+    # in a window around the previous score
+    assert any(alpha != -float('inf') and beta != float('inf')
+               for alpha, beta in pool.windows)
+
+
+def test_worker_processes_keep_to_the_time_limit(monkeypatch):
+    monkeypatch.setenv('A4_SEARCH_WORKERS', '2')
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(FIAR, 'X', 'Tester', utterances_matter=False)
+    try:
+        # the workers are started by prepare, not by the first move
+        assert len(agent._search_pool._processes) == 2
+        state = State(old=FIAR.initial_state)
+        for turn in range(6):
+            start = time.monotonic()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result, _remark = agent.make_move(
+                    state, '', time_limit=0.25, max_ply=None, use_iterative_deepening=True,
+                    use_parallel_search=True, **OPTIONS)
+            assert time.monotonic() - start < 0.25
+            assert agent._search_pool is not None
+            state = result[1]
+    finally:
+        agent.shutdown_search_pool()
@@ -0,0 +1,146 @@
+import contextlib
+import io
+
+from game_types import State, FIAR, Cassini
+import twu29_KInARow as agent_module
+from twu29_KInARow import (PositionCache, TTEntry, ZobristTable, position_cache_config,
+                           position_cache_path)
+from benchmark import position
+
+OPTIONS = dict(use_zobrist_hashing=True, use_incremental_eval=True, use_make_unmake=True,
+               use_win_detection=True, move_radius=2)
+
+
+def small_cache(tmp_path, game_type=FIAR):
+    return PositionCache(game_type, str(tmp_path / 'positions.bin'), slots=1024)
+
+
+def test_round_trip(tmp_path):
+    cache = small_cache(tmp_path)
+    entries = [TTEntry(0x1234, 3, 17.0, ZobristTable.EXACT, (2, 5), 1),
+               TTEntry(0xfeedbeef, 1, -4.5, ZobristTable.LOWER, None, 1),
+               TTEntry(1 << 63, 6, 999999990.0, ZobristTable.UPPER, (6, 6), 1)]
+    assert cache.merge(entries) == 3
+    cache.open()
+    for entry in entries:
+        stored = cache.probe(entry.key)
+        assert stored[:5] == entry[:5]
+    assert cache.probe(0x1234 + 1024) is None
+
+
+def test_deeper_search_is_kept(tmp_path):
+    cache = small_cache(tmp_path)
+    cache.merge([TTEntry(99, 5, 1.0, ZobristTable.EXACT, (1, 1), 1)])
+    assert cache.merge([TTEntry(99, 2, 2.0, ZobristTable.EXACT, (2, 2), 1)]) == 0
+    cache.open()
+    assert cache.probe(99).depth == 5
+
+
+def test_file_for_another_board_is_ignored(tmp_path):
+    small_cache(tmp_path, FIAR).merge([TTEntry(7, 1, 1.0, ZobristTable.EXACT, None, 1)])
+    cache = small_cache(tmp_path, Cassini)
+    cache.open()
+    assert cache.map is None
+
+
+def test_file_of_another_configuration_is_not_read(tmp_path):
+    small_cache(tmp_path).merge([TTEntry(7, 1, 1.0, ZobristTable.EXACT, None, 1)])
+    cache = small_cache(tmp_path)
+    cache.configure(position_cache_config(2, True))
+    cache.open()
+    assert cache.map is None
+    # writing under the new configuration starts the file over
+    assert cache.merge([TTEntry(8, 1, 2.0, ZobristTable.EXACT, None, 1)]) == 1
+    cache.open()
+    assert cache.probe(7) is None
+    assert cache.probe(8).score == 2.0
+    old = small_cache(tmp_path)
+    old.open()
+    assert old.map is None
+
+
+def test_file_in_an_older_format_is_started_over(tmp_path):
+    path = tmp_path / 'positions.bin'
+    path.write_bytes(b'KCACHE1\0' + bytes(10 + 100 * PositionCache.SLOT_SIZE))
+    cache = small_cache(tmp_path)
+    assert cache.merge([TTEntry(7, 1, 1.0, ZobristTable.EXACT, None, 1)]) == 1
+    cache.open()
+    assert cache.probe(7).score == 1.0
+
+
+def test_slot_read_after_the_file_is_started_over_is_ignored(tmp_path):
+    # Another process clears the file for its configuration while ours
+    # is mapped.
+    small_cache(tmp_path).merge([TTEntry(7, 1, 1.0, ZobristTable.EXACT, None, 1)])
+    cache = small_cache(tmp_path)
+    cache.open()
+    other = small_cache(tmp_path)
+    other.config = position_cache_config(2, True)
+    other.merge([TTEntry(7, 4, 3.0, ZobristTable.EXACT, None, 1)])
+    assert cache.probe(7) is None
+
+
+def test_table_prefers_the_deeper_entry(tmp_path):
+    cache = small_cache(tmp_path)
+    cache.merge([TTEntry(42, 6, 5.0, ZobristTable.EXACT, (3, 3), 1)])
+    cache.open()
+    table = ZobristTable(FIAR, capacity=64)
+    table.backing = cache
+    table.store(42, 2, 1.0, ZobristTable.EXACT, (0, 1))
+    assert table.probe(42).depth == 6
+    table.store(42, 8, 1.0, ZobristTable.EXACT, (0, 1))
+    assert table.probe(42).depth == 8
+
+
+def test_next_game_starts_from_what_the_last_one_found(tmp_path, monkeypatch):
+    monkeypatch.setenv('A4_POSITION_CACHE', str(tmp_path))
+    game_type, state, _depth = position('FIAR-mid')
+    evals = []
+    for game in range(2):
+        agent = agent_module.OurAgent()
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent.prepare(game_type, state.whose_move, 'Tester', utterances_matter=False)
+            result, _remark = agent.make_move(State(old=state), '', time_limit=None,
+                                              max_ply=3, use_position_cache=True, **OPTIONS)
+        evals.append((result[0], agent.num_static_evals_this_turn))
+        agent.save_position_cache()
+    assert evals[0][0] == evals[1][0]
+    assert evals[1][1] < evals[0][1]
+
+
+def test_worker_maps_a_file_made_after_it_started(tmp_path, monkeypatch):
+    monkeypatch.setenv('A4_POSITION_CACHE', str(tmp_path))
+    game_type, state, _depth = position('FIAR-mid')
+    agent_module._init_search_worker(game_type)
+    worker = agent_module._worker_agent
+    assert worker.position_cache.map is None
+    PositionCache(game_type, position_cache_path(game_type, str(tmp_path)), slots=1024,
+                  config=position_cache_config(2, True)) \
+        .merge([TTEntry(5, 1, 1.0, ZobristTable.EXACT, None, 1)])
+    worker._search_subtree(State(old=state), (3, 5), 2, True, -float('inf'), float('inf'),
+                           None, dict(OPTIONS, use_position_cache=True), 1)
+    assert worker.position_cache.map is not None
+
+
+def test_next_game_with_other_options_does_not_reuse_the_file(tmp_path, monkeypatch):
+    monkeypatch.setenv('A4_POSITION_CACHE', str(tmp_path))
+    game_type, state, _depth = position('FIAR-mid')
+    evals, saved = [], []
+    for move_radius in (2, 1, 1):
+        agent = agent_module.OurAgent()
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent.prepare(game_type, state.whose_move, 'Tester', utterances_matter=False)
+            agent.make_move(State(old=state), '', time_limit=None, max_ply=3,
+                            use_position_cache=True, **dict(OPTIONS, move_radius=move_radius))
+        evals.append(agent.num_static_evals_this_turn)
+        saved.append(agent.save_position_cache())
+    fresh = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        fresh.prepare(game_type, state.whose_move, 'Tester', utterances_matter=False)
+        fresh.make_move(State(old=state), '', time_limit=None, max_ply=3,
+                        **dict(OPTIONS, move_radius=1))
+    # the radius-1 game found nothing from the radius-2 one, and the
+    # next radius-1 game found what it left
+    assert saved[0] > 0 and saved[1] > 0
+    assert evals[1] == fresh.num_static_evals_this_turn
+    assert evals[2] < evals[1]
@@ -0,0 +1,50 @@
+import contextlib
+import io
+import json
+
+import pytest
+
+from game_types import State, FIAR
+import twu29_KInARow as agent_module
+
+
+class Records:
+    def __init__(self):
+        self.records = []
+
+    def write(self, line):
+        self.records.append(json.loads(line))
+
+
+def prepared_agent():
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(FIAR, 'X', 'Tester', utterances_matter=False)
+    return agent
+
+
+def test_profiler_writes_one_record_per_move():
+    agent = prepared_agent()
+    sink = Records()
+    agent.profiler = agent_module.SearchProfiler(sink)
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.make_move(State(old=FIAR.initial_state), '', time_limit=None, max_ply=2,
+                        use_zobrist_hashing=True)
+    assert len(sink.records) == 1
+    assert sink.records[0]['nodes'] > 0
+
+
+def test_profiler_unwraps_the_agent_when_the_search_fails():
+    agent = prepared_agent()
+    sink = Records()
+    agent.profiler = agent_module.SearchProfiler(sink)
+
+    def failing_eval(state):
+        raise RuntimeError("eval failed")
+    with contextlib.redirect_stdout(io.StringIO()), pytest.raises(RuntimeError):
+        agent.make_move(State(old=FIAR.initial_state), '', time_limit=None, max_ply=2,
+                        use_zobrist_hashing=True, special_static_eval_fn=failing_eval)
+    for name, _category in agent_module.SearchProfiler.TIMED_METHODS:
+        assert name not in vars(agent)
+    assert 'probe' not in vars(agent.zobrist_table)
+    assert agent._tt is None
@@ -0,0 +1,206 @@
+import contextlib
+import io
+import random
+import time
+
+import pytest
+
+from game_types import State, Game_Type, FIAR, Cassini, TTT_INITIAL_STATE_DATA
+import twu29_KInARow as agent_module
+from benchmark import CORPUS, position
+
+FAST = dict(use_incremental_eval=True, use_make_unmake=True,
+            use_win_detection=True, move_radius=2)
+
+
+def prepared_agent(game_type, side='X'):
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(game_type, side, 'Tester', utterances_matter=False)
+    return agent
+
+
+def search(game_type, state, depth, **options):
+    agent = prepared_agent(game_type, state.whose_move)
+    with contextlib.redirect_stdout(io.StringIO()):
+        result, _remark = agent.make_move(State(old=state), '', time_limit=None,
+                                          max_ply=depth, **options)
+    return agent, result[0]
+
+
+@pytest.mark.parametrize('name', ['FIAR-mid', 'Cassini-mid'])
+def test_timeout_leaves_search_state_at_the_root(name):
+    game_type, state, _depth = position(name)
+    agent = prepared_agent(game_type, state.whose_move)
+    agent._begin_search(state, use_zobrist_hashing=True, use_symmetry=True,
+                        use_bitboards=True, **FAST)
+    root_hash = agent._zobrist_hash
+    root_frontier = sorted(agent._frontier.moves())
+    polls = []
+
+    def poll_clock(deadline):
+        # times out on the 200th clock read, deep in the tree
+        polls.append(deadline)
+        agent._poll_countdown = 1
+        if len(polls) == 200:
+            raise agent_module.SearchTimeout()
+    agent._poll_clock = poll_clock
+    agent._root_depth = 4
+    with pytest.raises(agent_module.SearchTimeout):
+        agent.minimax(agent._work_state, depth_remaining=4, pruning=True,
+                      alpha=-float('inf'), beta=float('inf'),
+                      deadline=time.monotonic() + 60, order_children=True)
+
+    assert agent._work_state.board == state.board
+    assert agent._work_state.whose_move == state.whose_move
+    assert agent._zobrist_hash == root_hash
+    assert agent._evaluator.score == agent.static_eval(state)
+    assert sorted(agent._frontier.moves()) == root_frontier
+    assert agent._move_stack == []
+    assert agent._bitboard.key() == agent_module.BitboardState.from_state(state).key()
+
+
+def test_plays_on_when_no_empty_cell_is_near_a_stone():
+    # the only stone is walled in by forbidden squares
+    walled = Game_Type("Walled", "Walled", 3, 3, 5,
+                       [[['X', '-', ' ', ' ', ' '],
+                         ['-', '-', ' ', ' ', ' '],
+                         [' ', ' ', ' ', ' ', ' ']], "O"], 10, 1)
+    state = State(old=walled.initial_state)
+    agent, move = search(walled, state, 2, **dict(FAST, move_radius=1))
+    assert agent.num_static_evals_this_turn > 0
+    assert state.board[move[0]][move[1]] == ' '
+
+
+def test_out_of_turns_is_a_draw():
+    # X threatens the top row, but the game ends on O's move
+    short = Game_Type("Short Tic-Tac-Toe", "TTT4", 3, 3, 3, TTT_INITIAL_STATE_DATA, 4, 1)
+    state = State(initial_state_data=[[list('XX '), list('O  '), list('   ')], 'O'])
+    agent = prepared_agent(short, 'O')
+    agent._begin_search(state, **FAST)
+    agent._root_depth = 3
+    value = agent.minimax(agent._work_state, depth_remaining=3, pruning=True,
+                          alpha=-float('inf'), beta=float('inf'), order_children=True)
+    assert value == 0
+
+
+def test_iterative_deepening_stops_at_max_ply():
+    game_type, state, _depth = position('FIAR-mid')
+    agent = prepared_agent(game_type, state.whose_move)
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.make_move(State(old=state), '', max_ply=2, use_iterative_deepening=True, **FAST)
+    assert agent.completed_depth_this_turn == 2
+
+
+def root_value(game_type, state, depth, **options):
+    # (value, move) of the deepest finished iteration of make_move
+    agent = prepared_agent(game_type, state.whose_move)
+    found = []
+    iterative_deepening = agent._iterative_deepening
+
+    def record(*args, **kwargs):
+        found.append(iterative_deepening(*args, **kwargs))
+        return found[-1]
+    agent._iterative_deepening = record
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.make_move(State(old=state), '', time_limit=None, max_ply=depth,
+                        use_iterative_deepening=True, **options)
+    return found[-1][:2]
+
+
+@pytest.mark.parametrize('name', sorted(CORPUS))
+@pytest.mark.parametrize('window', [None, 1, 50])
+def test_pvs_and_aspiration_match_alpha_beta(name, window):
+    game_type, state, depth = position(name)
+    value, _move = root_value(game_type, state, depth, **FAST)
+    for tt in (False, True):
+        assert root_value(game_type, state, depth, use_pvs=True, aspiration_window=window,
+                          use_zobrist_hashing=tt, **FAST)[0] == value
+
+
+def dynamic_search(agent, state, depth):
+    agent._begin_search(state, use_dynamic_ordering=True, **FAST)
+    agent._root_depth = depth
+    value = agent.minimax(agent._work_state, depth_remaining=depth, pruning=True,
+                          alpha=-float('inf'), beta=float('inf'), order_children=True)
+    killers, history = agent._killers, agent._history
+    agent._end_search()
+    return value, killers, history
+
+
+def test_dynamic_ordering_evaluates_no_children():
+    game_type, state, depth = position('FIAR-mid')
+    agent = prepared_agent(game_type, state.whose_move)
+
+    def no_ordering_evals(*args):
+        raise AssertionError('children scored for ordering')
+    agent._ordering_scores = no_ordering_evals
+    value, killers, history = dynamic_search(agent, state, depth)
+    assert value == root_value(game_type, state, depth, **FAST)[0]
+    assert killers
+    for ply, moves in killers.items():
+        assert 1 <= len(moves) <= 2 and len(set(moves)) == len(moves)
+        assert 0 <= ply < depth
+    # every killer caused a cutoff, so it has a history score
+    scores = [history[player][r][c] for moves in killers.values()
+              for (r, c) in moves for player in 'XO']
+    assert max(scores) > 0
+
+
+def test_history_ages_between_moves():
+    game_type, state, depth = position('FIAR-mid')
+    agent = prepared_agent(game_type, state.whose_move)
+    _value, _killers, history = dynamic_search(agent, state, depth)
+    before = {player: [row[:] for row in rows] for player, rows in history.items()}
+    assert any(any(row) for rows in before.values() for row in rows)
+    agent._begin_search(state, use_dynamic_ordering=True, **FAST)
+    assert agent._killers == {}
+    assert agent._history == {player: [[score >> 1 for score in row] for row in rows]
+                              for player, rows in before.items()}
+    agent._end_search()
+    # within one move (an iterative-deepening task of the same turn) it is kept
+    agent._begin_search(state, use_dynamic_ordering=True, new_turn=False, **FAST)
+    assert agent._history == {player: [[score >> 1 for score in row] for row in rows]
+                              for player, rows in before.items()}
+
+
+@pytest.mark.parametrize('name', ['TTT-mid', 'FIAR-mid', 'Cassini-mid'])
+def test_make_unmake_restores_board_and_hash(name):
+    game_type, state, _depth = position(name)
+    agent = prepared_agent(game_type, state.whose_move)
+    agent._begin_search(state, use_zobrist_hashing=True, **FAST)
+    table = agent.zobrist_table
+    work = agent._work_state
+    rng = random.Random(7)
+    placed = []
+    for step in range(200):
+        empty = [(r, c) for r, row in enumerate(work.board)
+                 for c, cell in enumerate(row) if cell == ' ']
+        if placed and (len(empty) < 2 or rng.random() < 0.4):
+            r, c, player = placed.pop()
+            agent._on_remove(r, c, player)
+        else:
+            r, c = rng.choice(empty)
+            player = work.whose_move
+            agent._on_place(r, c, player)
+            placed.append((r, c, player))
+        # the work state is the root with the placed stones on it
+        expected = State(old=state)
+        for (r, c, player) in placed:
+            expected.board[r][c] = player
+            expected.change_turn()
+        assert work.board == expected.board
+        assert work.whose_move == expected.whose_move
+        assert agent._zobrist_hash == table.hash_state(expected)
+    while placed:
+        agent._on_remove(*placed.pop())
+    assert work.board == state.board
+    assert agent._zobrist_hash == table.hash_state(state)
+
+    # a whole search leaves the work state at the root as well
+    agent._root_depth = 3
+    agent.minimax(work, depth_remaining=3, pruning=True, alpha=-float('inf'),
+                  beta=float('inf'), order_children=True)
+    assert work.board == state.board
+    assert agent._zobrist_hash == table.hash_state(state)
+    agent._end_search()
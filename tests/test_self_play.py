@@ -0,0 +1,33 @@
+import json
+
+from self_play import play_one, self_play
+
+X_SPEC = 'twu29_KInARow:{"max_ply": 2}'
+O_SPEC = 'twu29_KInARow:twin:{"max_ply": 2}'
+
+
+def test_self_play_writes_one_line_per_game(tmp_path):
+    out_path = tmp_path / 'games.jsonl'
+    totals = self_play('TTT', 2, out_path, X_SPEC, O_SPEC, time_per_move=1.0,
+                       workers=2, base_seed=7)
+    assert sum(totals.values()) == 2
+    records = [json.loads(line) for line in out_path.read_text().splitlines()]
+    assert len(records) == 2
+    assert sorted(record['seed'] for record in records) == [7, 8]
+    for record in records:
+        assert (record['game'], record['x'], record['o']) == ('TTT', X_SPEC, O_SPEC)
+        assert record['reason'] in ('k in a row', 'turn limit') # nobody forfeited
+        assert len(record['moves']) == len(record['times'])
+    for result in ('X', 'O', 'draw'):
+        assert totals[result] == sum(record['result'] == result for record in records)
+
+    # another run appends rather than overwriting
+    self_play('TTT', 1, out_path, X_SPEC, O_SPEC, time_per_move=1.0, workers=1)
+    assert len(out_path.read_text().splitlines()) == 3
+
+
+def test_same_seed_replays_the_same_game():
+    first = play_one('TTT', X_SPEC, O_SPEC, 1.0, seed=3)
+    second = play_one('TTT', X_SPEC, O_SPEC, 1.0, seed=3)
+    assert first['moves'] == second['moves']
+    assert first['result'] == second['result']
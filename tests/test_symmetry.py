@@ -0,0 +1,84 @@
+import random
+
+from game_types import State, TTT, FIAR, Cassini
+from twu29_KInARow import game_symmetries, OpeningBook
+
+
+def random_position(game_type, stones, rng):
+    state = State(old=game_type.initial_state)
+    cells = [(r, c) for r, row in enumerate(state.board)
+             for c, cell in enumerate(row) if cell == ' ']
+    for (r, c) in rng.sample(cells, stones):
+        state.board[r][c] = rng.choice('XO')
+    state.whose_move = rng.choice('XO')
+    return state
+
+
+def mirror(state, table):
+    # The image of state under a symmetry table.
+    image = State(old=state)
+    for r, row in enumerate(state.board):
+        for c, cell in enumerate(row):
+            rr, cc = table[r][c]
+            image.board[rr][cc] = cell
+    return image
+
+
+def test_symmetries_keep_forbidden_squares():
+    assert len(game_symmetries(TTT).tables) == 8
+    assert len(game_symmetries(FIAR).tables) == 8
+    for game_type in (TTT, FIAR, Cassini):
+        for table in game_symmetries(game_type).tables:
+            image = mirror(game_type.initial_state, table)
+            assert [[cell == '-' for cell in row] for row in image.board] \
+                == [[cell == '-' for cell in row] for row in game_type.initial_state.board]
+
+
+def test_canonical_hash_is_the_same_for_every_image():
+    rng = random.Random(3)
+    for game_type in (TTT, FIAR, Cassini):
+        symmetries = game_symmetries(game_type)
+        for trial in range(30):
+            state = random_position(game_type, rng.randrange(6), rng)
+            h, i = symmetries.canonical_hash(state)
+            for table in symmetries.tables:
+                assert symmetries.canonical_hash(mirror(state, table))[0] == h
+            # the hash is the hash of the image in its own frame
+            image = mirror(state, symmetries.tables[i])
+            assert symmetries.image_hashes(image)[0] == h
+
+
+def test_move_keys_update_every_image_hash():
+    rng = random.Random(4)
+    symmetries = game_symmetries(Cassini)
+    state = random_position(Cassini, 6, rng)
+    hashes = symmetries.image_hashes(state)
+    for (r, c) in [(r, c) for r, row in enumerate(state.board)
+                   for c, cell in enumerate(row) if cell == ' '][:5]:
+        player = state.whose_move
+        hashes = [h ^ keys[player][r][c] for h, keys in zip(hashes, symmetries.move_keys)]
+        state.board[r][c] = player
+        state.change_turn()
+        assert hashes == symmetries.image_hashes(state)
+
+
+def test_unique_moves_drops_mirror_images():
+    symmetries = game_symmetries(TTT)
+    moves = [(r, c) for r in range(3) for c in range(3)]
+    # corner, edge and centre
+    assert len(symmetries.unique_moves(TTT.initial_state, moves)) == 3
+
+
+def test_opening_book_answers_for_mirror_images(tmp_path):
+    book = OpeningBook(FIAR)
+    state = State(old=FIAR.initial_state)
+    state.board[1][2] = 'X'
+    state.change_turn()
+    h, table = book.canonical_hash(state)
+    move = (2, 2)
+    path = str(tmp_path / 'book.bin')
+    book.save(path, {h: table[move[0]][move[1]]})
+    book.load(path)
+    for table in game_symmetries(FIAR).tables:
+        rr, cc = table[move[0]][move[1]]
+        assert book.lookup(mirror(state, table)) == (rr, cc)
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import random
+
+import pytest
+
+from game_types import State, FIAR, Cassini
+import twu29_KInARow as agent_module
+from twu29_KInARow import ThreatSpaceSearch, WIN_SCORE, other_player, wins_through
+
+FULL_WIDTH = dict(use_win_detection=True, move_radius=None, use_incremental_eval=True,
+                  use_make_unmake=True, use_zobrist_hashing=True)
+
+
+def random_position(game_type, stones, rng):
+    state = State(old=game_type.initial_state)
+    cells = [(r, c) for r, row in enumerate(state.board)
+             for c, cell in enumerate(row) if cell == ' ']
+    for (r, c) in rng.sample(cells, stones):
+        state.board[r][c] = state.whose_move
+        state.change_turn()
+    return state
+
+
+def search_value(agent, state, depth):
+    agent._begin_search(state, **FULL_WIDTH)
+    agent._root_depth = depth
+    try:
+        return agent.minimax(agent._work_state, depth_remaining=depth, pruning=True,
+                             alpha=-float('inf'), beta=float('inf'), order_children=True)
+    finally:
+        agent._end_search()
+
+
+def line_depth(state, line, k):
+    # Plies for the attacker to play the line and win: the last move
+    # either completes k itself or makes two fours, one of which the
+    # defender cannot block.
+    board = State(old=state).board
+    for (r, c) in line:
+        board[r][c] = state.whose_move
+    r, c = line[-1]
+    if wins_through(board, r, c, k):
+        return 2 * len(line) - 1
+    return 2 * len(line) + 1
+
+
+@pytest.mark.parametrize('game_type', [FIAR, Cassini])
+def test_vcf_lines_win_in_a_full_width_search(game_type):
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(game_type, 'X', 'Tester', utterances_matter=False)
+    rng = random.Random(5)
+    checked = {}
+    for trial in range(2000):
+        state = random_position(game_type, rng.randrange(6, 20), rng)
+        attacker = state.whose_move
+        solver = ThreatSpaceSearch(game_type)
+        solver.load(state)
+        if solver.winning_cells(other_player(attacker)):
+            continue # the defender wins first
+        line = solver.find_win(attacker)
+        # longer lines are proven the same way, but too slow to search here
+        if line is None or len(line) > 2:
+            continue
+        depth = line_depth(state, line, game_type.k)
+        value = search_value(agent, state, depth)
+        if attacker == 'X':
+            assert value > WIN_SCORE // 2, (state.board, line)
+        else:
+            assert value < -WIN_SCORE // 2, (state.board, line)
+        checked[len(line)] = checked.get(len(line), 0) + 1
+        if sum(checked.values()) >= 25 and 2 in checked:
+            break
+    assert 2 in checked
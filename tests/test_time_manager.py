@@ -0,0 +1,92 @@
+import contextlib
+import io
+import time
+
+import pytest
+
+from game_types import State, FIAR
+import twu29_KInARow as agent_module
+from twu29_KInARow import TimeManager, game_phase
+
+FAST = dict(use_incremental_eval=True, use_make_unmake=True,
+            use_win_detection=True, move_radius=2)
+
+
+def filled(stones):
+    # FIAR with the first stones empty cells taken, X and O in turn.
+    state = State(old=FIAR.initial_state)
+    cells = [(r, c) for r, row in enumerate(state.board)
+             for c, cell in enumerate(row) if cell == ' ']
+    for (r, c) in cells[:stones]:
+        state.board[r][c] = state.whose_move
+        state.change_turn()
+    return state
+
+
+@pytest.mark.parametrize('stones, phase', [(0, 'opening'), (20, 'middlegame'), (30, 'endgame')])
+def test_budget_follows_the_phase(stones, phase):
+    state = filled(stones)
+    assert game_phase(state) == phase
+    manager = TimeManager(FIAR)
+    manager.start(state, 10.0, 100.0, 20)
+    assert manager.hard_deadline == pytest.approx(100.0 + 10.0 * TimeManager.SAFETY)
+    assert manager.soft_deadline == pytest.approx(100.0 + 10.0 * TimeManager.PHASE_SHARE[phase])
+
+
+def test_budget_shrinks_for_forced_moves_and_late_turns():
+    manager = TimeManager(FIAR)
+    manager.start(filled(0), 10.0, 0.0, 2)
+    assert manager.soft_deadline == pytest.approx(10.0 * 0.4 * TimeManager.FEW_MOVES_SHARE)
+    late = filled(FIAR.turn_limit - 5)
+    manager.start(late, 10.0, 0.0, 20)
+    share = TimeManager.PHASE_SHARE[game_phase(late)] * 0.5
+    assert manager.soft_deadline == pytest.approx(10.0 * share)
+
+
+def test_stable_best_move_stops_early():
+    manager = TimeManager(FIAR)
+    start = time.monotonic()
+    manager.start(filled(20), 100.0, start, 20)
+    soft = manager.soft_deadline
+    for _ in range(TimeManager.STABLE_ITERATIONS):
+        manager.iteration_done((1, 1), 0.01)
+        assert manager.soft_deadline == soft
+    manager.iteration_done((1, 1), 0.01)
+    now = time.monotonic()
+    # half of what was left of the soft time is given back
+    assert manager.soft_deadline < soft
+    assert manager.soft_deadline == pytest.approx(soft - (soft - now) / 2, abs=0.05)
+
+
+def test_changing_best_move_buys_time():
+    manager = TimeManager(FIAR)
+    manager.start(filled(0), 100.0, time.monotonic(), 20)
+    soft = manager.soft_deadline
+    manager.iteration_done((1, 1), 0.01)
+    manager.iteration_done((2, 2), 0.01)
+    assert manager.soft_deadline == pytest.approx(soft + 25.0)
+    for move in [(3, 3), (4, 4), (5, 5)]:
+        manager.iteration_done(move, 0.01)
+    assert manager.soft_deadline == manager.hard_deadline
+
+
+def test_no_iteration_that_would_pass_the_hard_deadline():
+    manager = TimeManager(FIAR)
+    manager.start(filled(20), 1.0, time.monotonic(), 20)
+    assert manager.start_iteration()
+    manager.iteration_done((1, 1), 0.1)
+    manager.iteration_done((1, 1), 0.5)
+    # the next iteration would take about 2.5 s
+    assert not manager.start_iteration()
+
+
+def test_time_manager_deepens_and_keeps_to_max_ply():
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(FIAR, 'X', 'Tester', utterances_matter=False)
+        start = time.monotonic()
+        agent.make_move(filled(10), '', time_limit=5.0, max_ply=2,
+                        use_time_manager=True, **FAST)
+    assert agent.completed_depth_this_turn == 2
+    assert len(agent.time_manager.iteration_times) == 2
+    assert time.monotonic() - start < 5.0
@@ -0,0 +1,103 @@
+import contextlib
+import io
+import threading
+import time
+
+import pytest
+
+from game_types import State, FIAR
+
+import twu29_KInARow as agent_module
+from twu29_KInARow import UtteranceBackend, UtteranceCache, StubBackend
+
+
+def test_persists_between_runs(tmp_path):
+    path = str(tmp_path / 'utterances.json')
+    cache = UtteranceCache(path=path)
+    key = UtteranceCache.key('Kim Kardashian', 2, 'Nice move!', 'opening')
+    cache.put(key, ['Thanks, babe.'])
+    assert UtteranceCache(path=path).get(key) == 'Thanks, babe.'
+
+
+def test_least_recently_used_entry_goes_first():
+    cache = UtteranceCache(capacity=2)
+    cache.put('a', ['1'])
+    cache.put('b', ['2'])
+    cache.get('a')
+    cache.put('c', ['3'])
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+
+
+def test_get_does_not_wait_for_the_file(tmp_path, monkeypatch):
+    cache = UtteranceCache(path=str(tmp_path / 'utterances.json'))
+    cache.put('a', ['1'])
+    writing = threading.Event()
+    release = threading.Event()
+    dump = agent_module.json.dump
+
+    def slow_dump(obj, f):
+        writing.set()
+        release.wait(5)
+        dump(obj, f)
+    monkeypatch.setattr(agent_module.json, 'dump', slow_dump)
+    writer = threading.Thread(target=cache.put, args=('b', ['2']))
+    writer.start()
+    assert writing.wait(5)
+    try:
+        # the backend thread is stuck writing; the main thread is not
+        got = []
+        reader = threading.Thread(target=lambda: got.append(cache.get('a')))
+        reader.start()
+        reader.join(1)
+        assert got == ['1']
+    finally:
+        release.set()
+        writer.join()
+
+
+def test_backend_must_generate():
+    with pytest.raises(TypeError):
+        UtteranceBackend()
+
+
+def test_shutdown_drops_waiting_requests():
+    agent = agent_module.OurAgent()
+    agent.utterance_backend = StubBackend(delay=0.2)
+    futures = [agent._submit_to_backend('prompt') for _ in range(6)]
+    agent.shutdown_utterance_pool()
+    assert agent._utterance_pool is None
+    assert sum(future.cancelled() for future in futures) >= 4
+
+
+def slow_agent(latency_cap):
+    agent = agent_module.OurAgent()
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent.prepare(FIAR, 'X', 'Tester', utterances_matter=False)
+    agent.utterance_backend = StubBackend(lines=['From the backend.'], delay=2.0)
+    agent.utterance_latency_cap = latency_cap
+    return agent
+
+
+def timed_move(agent, time_limit):
+    start = time.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result, remark = agent.make_move(State(old=FIAR.initial_state), '',
+                                         time_limit=time_limit, max_ply=1)
+    return time.monotonic() - start, result[0], remark
+
+
+def test_slow_backend_hits_the_latency_cap():
+    agent = slow_agent(0.1)
+    elapsed, move, remark = timed_move(agent, None)
+    assert 0.1 <= elapsed < 0.5
+    assert str(move) in remark
+    agent.shutdown_utterance_pool()
+
+
+@pytest.mark.parametrize('time_limit', [0.1, 0.25])
+def test_slow_backend_leaves_the_safety_margin(time_limit):
+    agent = slow_agent(0.5)
+    elapsed, move, remark = timed_move(agent, time_limit)
+    assert elapsed < time_limit * 0.98
+    assert str(move) in remark
+    agent.shutdown_utterance_pool()
@@ -6,7 +6,7 @@ An agent for playing "K-in-a-Row with Forbidden Squares" and related games.
 '''
 
 from agent_base import KAgent
-from game_types import State, Game_Type
+from game_types import State, Game_Type, BitboardState
 
 AUTHORS = 'Alley Wu and Katharina Cheng' 
 UWNETIDS = ['twu29', 'qiaoyc2']
@@ -15,7 +15,1462 @@ import time # need this to avoid losing a
  # game due to exceeding a time limit.
 import math
 import os, random
+import atexit
+import json
+import mmap
+import struct
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_for_futures
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import google.generativeai as genai
+try:
+    import numpy as np # optional: only needed for BatchEvaluator
+except ImportError:
+    np = None
+try:
+    import fcntl # optional: PositionCache locks its file with it where there is one
+except ImportError:
+    fcntl = None
+
+
+class Frontier:
+    '''Candidate moves: the empty cells within radius (in king steps) of
+    some stone, kept up to date as stones are placed and taken back.
+
+    near[r][c] counts the stones within radius of (r, c); a cell is a
+    candidate while it is empty and that count is positive. On a board
+    with no stones the only candidate is the opening move, the playable
+    cell nearest the center.
+    '''
+    def __init__(self, state, radius):
+        board = state.board
+        self.n = len(board)
+        self.m = len(board[0])
+        self.radius = radius
+        self.occupied = [[cell != ' ' for cell in row] for row in board]
+        self.near = [[0] * self.m for r in range(self.n)]
+        self.candidates = set()
+        self.num_stones = 0
+        for r, row in enumerate(board):
+            for c, cell in enumerate(row):
+                if cell == 'X' or cell == 'O':
+                    self._add_stone(r, c)
+        empties = [(r, c) for r in range(self.n) for c in range(self.m)
+                   if not self.occupied[r][c]]
+        center_r, center_c = (self.n - 1) / 2, (self.m - 1) / 2
+        self.opening_move = min(
+            empties, default=None,
+            key=lambda rc: (abs(rc[0] - center_r) + abs(rc[1] - center_c), rc))
+
+    def _neighborhood(self, r, c):
+        d = self.radius
+        for rr in range(max(0, r - d), min(self.n, r + d + 1)):
+            for cc in range(max(0, c - d), min(self.m, c + d + 1)):
+                yield rr, cc
+
+    def _add_stone(self, r, c):
+        self.num_stones += 1
+        occupied, near, candidates = self.occupied, self.near, self.candidates
+        for rr, cc in self._neighborhood(r, c):
+            near[rr][cc] += 1
+            if near[rr][cc] == 1 and not occupied[rr][cc]:
+                candidates.add((rr, cc))
+
+    def place(self, r, c):
+        self.occupied[r][c] = True
+        self.candidates.discard((r, c))
+        self._add_stone(r, c)
+
+    def remove(self, r, c):
+        self.num_stones -= 1
+        occupied, near, candidates = self.occupied, self.near, self.candidates
+        occupied[r][c] = False
+        for rr, cc in self._neighborhood(r, c):
+            near[rr][cc] -= 1
+            if near[rr][cc] == 0:
+                candidates.discard((rr, cc))
+        if near[r][c] > 0:
+            candidates.add((r, c))
+
+    def moves(self):
+        # Candidates in row-major order, like a scan of the board.
+        if self.num_stones == 0:
+            return [] if self.opening_move is None else [self.opening_move]
+        return sorted(self.candidates)
+
+
+def zobrist_keys(game_type, seed=415):
+    # Random 64-bit keys: piece_keys[piece][r][c] for each stone and
+    # side_key for "O to move". A fixed seed gives the same keys in every
+    # process and every run, so hashes can be stored on disk.
+    rng = random.Random(seed)
+    piece_keys = {
+        piece: [[rng.getrandbits(64) for c in range(game_type.m)]
+                for r in range(game_type.n)]
+        for piece in ('X', 'O')}
+    side_key = rng.getrandbits(64)
+    return piece_keys, side_key
+
+# One transposition-table slot. flag is EXACT, LOWER or UPPER (see below).
+TTEntry = namedtuple('TTEntry', 'key depth score flag best_move generation')
+
+class ZobristTable:
+    '''Transposition table for K-in-a-Row positions, keyed by Zobrist hash.
+
+    A hash is the XOR of one random 64-bit key per (piece, cell) on the
+    board, plus side_key when O is to move, so placing or removing a stone
+    updates it with a single XOR (see move_key).
+
+    The table has a fixed number of slots indexed by hash modulo capacity.
+    A slot is overwritten if it is empty, was written on an earlier turn,
+    or holds a search that was no deeper than the new one.
+    '''
+    EXACT = 0 # score is the minimax value
+    LOWER = 1 # search failed high: true value >= score
+    UPPER = 2 # search failed low: true value <= score
+
+    def __init__(self, game_type, capacity=1 << 16, seed=415):
+        self.game_type = game_type
+        self.piece_keys, self.side_key = zobrist_keys(game_type, seed)
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.generation = 0
+        # PositionCache looked at when the table misses (None: none)
+        self.backing = None
+
+    def new_turn(self):
+        # Entries from earlier turns stay probe-able but become replaceable.
+        self.generation += 1
+
+    def hash_state(self, state):
+        h = 0
+        for r, row in enumerate(state.board):
+            for c, cell in enumerate(row):
+                if cell == 'X' or cell == 'O':
+                    h ^= self.piece_keys[cell][r][c]
+        if state.whose_move == 'O':
+            h ^= self.side_key
+        return h
+
+    def move_key(self, r, c, player):
+        # XOR this into a hash to have player place (or take back) a stone
+        # at (r, c); it also flips the side to move.
+        return self.piece_keys[player][r][c] ^ self.side_key
+
+    def probe(self, h):
+        entry = self.slots[h % self.capacity]
+        if entry is None or entry.key != h:
+            entry = None
+        if self.backing is not None:
+            # the file may hold a deeper search of the position
+            stored = self.backing.probe(h)
+            if stored is not None and (entry is None or stored.depth > entry.depth):
+                return stored
+        return entry
+
+    def store(self, h, depth, score, flag, best_move):
+        # Returns True if the entry was written.
+        i = h % self.capacity
+        old = self.slots[i]
+        if old is None or old.generation != self.generation or depth >= old.depth:
+            self.slots[i] = TTEntry(h, depth, score, flag, best_move, self.generation)
+            return True
+        return False
+
+
+class PositionCache:
+    '''Search results kept on disk from one game to the next (make_move
+    with use_position_cache=True): a fixed-size file of transposition
+    slots, indexed like ZobristTable by hash modulo the slot count, that
+    the table falls back on when it misses.
+
+    The file is memory-mapped read-only, so opening it costs next to
+    nothing however big it is, and agent processes on one machine share
+    its pages. Entries are written back by merge(), under an exclusive
+    lock, replacing a slot unless it holds a deeper search. A slot's key
+    is stored XORed with its data, so a slot read while another process
+    rewrites it does not match.
+
+    The scores depend on how the search was set up, so the file records
+    that as well (config, see position_cache_config). A cache reads
+    nothing from a file of another configuration, and merge() starts
+    such a file over.
+
+    File layout: MAGIC, then n, m, the slot count and the config (struct
+    "<HHIHBB"), then the slots: key, and score, depth, flag and move cell
+    r*m + c (NO_MOVE if none) as DATA.
+    '''
+    MAGIC = b'KCACHE2\0'
+    HEADER = struct.Struct('<HHIHBB')
+    DATA = struct.Struct('<dhBB')
+    SLOT_SIZE = 8 + DATA.size
+    NO_MOVE = 255
+    ALL_CELLS = 255
+    SLOTS = 1 << 20
+
+    def __init__(self, game_type, path, slots=SLOTS, config=None):
+        self.game_type = game_type
+        self.path = path
+        self.slots = slots
+        self.config = position_cache_config() if config is None else config
+        self.map = None
+        self.capacity = 0
+        self._first_slot = len(self.MAGIC) + self.HEADER.size
+        self._header = None
+
+    def open(self):
+        # Maps the file read-only. A missing file, or one made for another
+        # board or configuration, leaves the cache empty.
+        self.close()
+        try:
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        header = self._read_header(data, len(data))
+        if header is None or header[0] != (self.game_type.n, self.game_type.m) \
+                or header[2] != self.config:
+            data.close()
+            return
+        self.map, self.capacity = data, header[1]
+        self._header = data[:self._first_slot]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.map = None
+        self.capacity = 0
+        self._header = None
+
+    def configure(self, config):
+        # Sets the configuration of the searches to come; the file is
+        # mapped again if it changes.
+        if config != self.config:
+            self.config = config
+            self.open()
+
+    def _read_header(self, data, size):
+        # ((n, m), slot count, config) from the header at the start of
+        # data, of a file of size bytes, or None if it is not a cache file
+        # in this format.
+        if size < self._first_slot or data[:len(self.MAGIC)] != self.MAGIC:
+            return None
+        n, m, capacity, *config = self.HEADER.unpack_from(data, len(self.MAGIC))
+        if capacity == 0 or size < self._first_slot + capacity * self.SLOT_SIZE:
+            return None
+        return (n, m), capacity, tuple(config)
+
+    @staticmethod
+    def _check(data):
+        # what a slot's key is XORed with
+        return int.from_bytes(data[:8], 'little') ^ int.from_bytes(data[8:], 'little')
+
+    def probe(self, h):
+        # The stored entry for hash h as a TTEntry, or None.
+        if self.map is None:
+            return None
+        offset = self._first_slot + (h % self.capacity) * self.SLOT_SIZE
+        slot = self.map[offset:offset + self.SLOT_SIZE]
+        data = slot[8:]
+        if int.from_bytes(slot[:8], 'little') ^ self._check(data) != h:
+            return None
+        # merge() rewrites the header before the slots when it starts the
+        # file over, so a header unchanged after the read means the slot
+        # is of our configuration.
+        if self.map[:self._first_slot] != self._header:
+            return None
+        score, depth, flag, cell = self.DATA.unpack(data)
+        best_move = None if cell == self.NO_MOVE else divmod(cell, self.game_type.m)
+        return TTEntry(h, depth, score, flag, best_move, -1)
+
+    def merge(self, entries):
+        # Writes entries (TTEntry), found under self.config, into the file.
+        # A missing file, one in an older format or one of another
+        # configuration is started over. Returns how many were written.
+        n, m = self.game_type.n, self.game_type.m
+        written = 0
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with open(fd, 'r+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            start = f.read(self._first_slot)
+            if size and not start.startswith(self.MAGIC[:6]): # b'KCACHE', any version
+                raise ValueError(f"{self.path} is not a position cache")
+            header = self._read_header(start, size)
+            if header is not None and header[0] != (n, m):
+                raise ValueError(f"{self.path} is a position cache for another board")
+            if header is None or header[2] != self.config:
+                # Other processes may have the file mapped, so it is
+                # cleared in place and never made shorter.
+                size = max(size, self._first_slot + self.slots * self.SLOT_SIZE)
+                f.truncate(size)
+            data = mmap.mmap(f.fileno(), 0)
+            try:
+                if header is None or header[2] != self.config:
+                    data[:self._first_slot] = self.MAGIC + self.HEADER.pack(
+                        n, m, self.slots, *self.config)
+                    data[self._first_slot:] = bytes(size - self._first_slot)
+                    capacity = self.slots
+                else:
+                    capacity = header[1]
+                for entry in entries:
+                    offset = self._first_slot + (entry.key % capacity) * self.SLOT_SIZE
+                    old = data[offset:offset + self.SLOT_SIZE]
+                    if any(old) and self.DATA.unpack(old[8:])[1] > entry.depth:
+                        continue
+                    move = entry.best_move
+                    cell = self.NO_MOVE if move is None else move[0] * m + move[1]
+                    packed = self.DATA.pack(entry.score, entry.depth, entry.flag, cell)
+                    key = entry.key ^ self._check(packed)
+                    data[offset:offset + self.SLOT_SIZE] = key.to_bytes(8, 'little') + packed
+                    written += 1
+                data.flush()
+            finally:
+                data.close()
+        return written
+
+
+# Score of a won game, minus the number of stones on the board so that
+# quicker wins (and slower losses) are preferred. Far above any static_eval.
+WIN_SCORE = 10 ** 9
+
+# Bump whenever static_eval scores positions differently, so that what
+# is kept in position caches under the old scores is thrown away.
+EVAL_VERSION = 1
+
+def k_windows(game_type):
+    # Every line of k cells (horizontal, vertical and both diagonals) on
+    # the game's board, each as a tuple of (row, col) cells.
+    n, m, k = game_type.n, game_type.m, game_type.k
+    windows = []
+    for r in range(n):
+        for c in range(m - k + 1):
+            windows.append(tuple((r, c + i) for i in range(k)))
+    for c in range(m):
+        for r in range(n - k + 1):
+            windows.append(tuple((r + i, c) for i in range(k)))
+    for r in range(n - k + 1):
+        for c in range(m - k + 1):
+            windows.append(tuple((r + i, c + i) for i in range(k)))
+    for r in range(k - 1, n):
+        for c in range(m - k + 1):
+            windows.append(tuple((r - i, c + i) for i in range(k)))
+    return windows
+
+class WindowTables:
+    '''Board geometry of one Game_Type, worked out once (see window_tables).
+
+    windows lists the k-windows that can still be won, i.e. that do not
+    touch a forbidden square, as tuples of flat cell indices r*m + c;
+    window_cells holds the same windows as tuples of (r, c) cells, and
+    cell_windows[r*m + c] the indices of the windows through that cell;
+    cell_masks[r*m + c] has the windows through the cell as BitboardState
+    masks, for BitboardState.completes_line.
+    '''
+    def __init__(self, game_type):
+        self.game_type = game_type
+        self.m = m = game_type.m
+        board = game_type.initial_state.board
+        self.window_cells = [cells for cells in k_windows(game_type)
+                             if all(board[r][c] != '-' for (r, c) in cells)]
+        self.windows = [tuple(r * m + c for (r, c) in cells)
+                        for cells in self.window_cells]
+        self.cell_windows = [[] for i in range(game_type.n * m)]
+        for w, cells in enumerate(self.windows):
+            for i in cells:
+                self.cell_windows[i].append(w)
+        bitboard = BitboardState.from_state(game_type.initial_state)
+        masks = [sum(bitboard.bit(r, c) for (r, c) in cells) for cells in self.window_cells]
+        self.cell_masks = [[masks[w] for w in windows] for windows in self.cell_windows]
+
+_window_tables_cache = {}
+
+def window_tables(game_type):
+    # The WindowTables of game_type, built on first use.
+    tables = _window_tables_cache.get(game_type)
+    if tables is None:
+        tables = _window_tables_cache[game_type] = WindowTables(game_type)
+    return tables
+
+def wins_through(board, r, c, k):
+    # True if the stone at (r, c) is part of k in a row. Only the four
+    # lines through (r, c) are scanned; a forbidden square ends a line.
+    piece = board[r][c]
+    n = len(board)
+    m = len(board[0])
+    for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        count = 1
+        rr, cc = r + dr, c + dc
+        while 0 <= rr < n and 0 <= cc < m and board[rr][cc] == piece:
+            count += 1
+            rr += dr
+            cc += dc
+        rr, cc = r - dr, c - dc
+        while 0 <= rr < n and 0 <= cc < m and board[rr][cc] == piece:
+            count += 1
+            rr -= dr
+            cc -= dc
+        if count >= k:
+            return True
+    return False
+
+def window_score(count_x, count_o):
+    # An open line with j stones is worth 10**(j-1) to its owner; a line
+    # holding both colors is dead.
+    if count_o == 0:
+        if count_x == 0:
+            return 0
+        return 10 ** (count_x - 1)
+    if count_x == 0:
+        return -(10 ** (count_o - 1))
+    return 0
+
+class IncrementalEvaluator:
+    '''Keeps OurAgent.static_eval's score up to date as stones come and go.
+
+    Holds the X and O count of every k-window and the running total, so
+    placing or removing a stone only rescores the windows through that
+    cell (at most 4*k of them) instead of sweeping the whole board.
+    '''
+    def __init__(self, game_type):
+        self.game_type = game_type
+        tables = window_tables(game_type)
+        self.m = game_type.m
+        self.windows = tables.window_cells
+        self.cell_windows = tables.cell_windows
+        self.x_counts = [0] * len(self.windows)
+        self.o_counts = [0] * len(self.windows)
+        self.score = 0
+
+    def load(self, state):
+        board = state.board
+        self.score = 0
+        for w, cells in enumerate(self.windows):
+            line = [board[r][c] for (r, c) in cells]
+            self.x_counts[w] = line.count('X')
+            self.o_counts[w] = line.count('O')
+            self.score += window_score(self.x_counts[w], self.o_counts[w])
+
+    def place(self, r, c, piece):
+        counts = self.x_counts if piece == 'X' else self.o_counts
+        x_counts, o_counts = self.x_counts, self.o_counts
+        delta = 0
+        for w in self.cell_windows[r * self.m + c]:
+            delta -= window_score(x_counts[w], o_counts[w])
+            counts[w] += 1
+            delta += window_score(x_counts[w], o_counts[w])
+        self.score += delta
+
+    def remove(self, r, c, piece):
+        counts = self.x_counts if piece == 'X' else self.o_counts
+        x_counts, o_counts = self.x_counts, self.o_counts
+        delta = 0
+        for w in self.cell_windows[r * self.m + c]:
+            delta -= window_score(x_counts[w], o_counts[w])
+            counts[w] -= 1
+            delta += window_score(x_counts[w], o_counts[w])
+        self.score += delta
+
+class ThreatSearchBudgetExceeded(Exception):
+    pass
+
+class ThreatSpaceSearch:
+    '''Tactical solver that only looks at forcing moves.
+
+    A "four" is a k-window (clear of forbidden squares) holding k-1 of a
+    player's stones and one empty cell; the opponent must fill that cell
+    at once. find_win looks for a victory by continuous fours (VCF): the
+    attacker turns a k-2 window into a four, the defender's reply is
+    forced, and the line wins when the attacker has a stone-away win in
+    two places at once. Every defender reply in such a line is forced,
+    so a line found is a proven win.
+
+    find_defenses takes the other side: given that the opponent has such
+    a line, it tries the cells the line uses, plus our own fours, and
+    keeps the moves after which the opponent has no VCF left.
+
+    Both stop with ThreatSearchBudgetExceeded after max_nodes positions
+    or at the deadline, so the caller can fall back on the full search.
+    '''
+    def __init__(self, game_type, max_nodes=3000):
+        self.k = game_type.k
+        self.max_nodes = max_nodes
+        tables = window_tables(game_type)
+        self.m = game_type.m
+        self.windows = tables.window_cells
+        self.cell_windows = tables.cell_windows
+        self.nodes = 0
+        self.deadline = None
+
+    def load(self, state, deadline=None):
+        self.board = [row[:] for row in state.board]
+        self.counts = {'X': [0] * len(self.windows), 'O': [0] * len(self.windows)}
+        for i, cells in enumerate(self.windows):
+            for (r, c) in cells:
+                piece = self.board[r][c]
+                if piece == 'X' or piece == 'O':
+                    self.counts[piece][i] += 1
+        self.nodes = 0
+        self.deadline = deadline
+
+    def place(self, r, c, player):
+        self.board[r][c] = player
+        counts = self.counts[player]
+        for i in self.cell_windows[r * self.m + c]:
+            counts[i] += 1
+
+    def remove(self, r, c, player):
+        self.board[r][c] = ' '
+        counts = self.counts[player]
+        for i in self.cell_windows[r * self.m + c]:
+            counts[i] -= 1
+
+    def _empty_cells(self, i):
+        return [(r, c) for (r, c) in self.windows[i] if self.board[r][c] == ' ']
+
+    def winning_cells(self, player):
+        # Empty cells where player would complete k in a row.
+        own, other = self.counts[player], self.counts[other_player(player)]
+        k = self.k
+        cells = set()
+        for i in range(len(self.windows)):
+            if own[i] == k - 1 and other[i] == 0:
+                cells.update(self._empty_cells(i))
+        return cells
+
+    def four_moves(self, player):
+        # Empty cells that turn some k-2 window of player's into a four.
+        own, other = self.counts[player], self.counts[other_player(player)]
+        k = self.k
+        cells = set()
+        for i in range(len(self.windows)):
+            if own[i] == k - 2 and other[i] == 0:
+                cells.update(self._empty_cells(i))
+        return sorted(cells)
+
+    def _tick(self):
+        self.nodes += 1
+        if self.nodes > self.max_nodes or (
+                self.deadline is not None and time.monotonic() >= self.deadline):
+            raise ThreatSearchBudgetExceeded()
+
+    def find_win(self, attacker):
+        # With attacker to move, the attacker's moves of a VCF (the
+        # defender's replies are implied), or None if there is none.
+        self._tick()
+        defender = other_player(attacker)
+        wins = self.winning_cells(attacker)
+        if wins:
+            return [min(wins)]
+        must_block = self.winning_cells(defender)
+        if len(must_block) > 1:
+            return None
+        if must_block:
+            candidates = list(must_block)
+        else:
+            candidates = self.four_moves(attacker)
+        for (r, c) in candidates:
+            self.place(r, c, attacker)
+            try:
+                threats = self.winning_cells(attacker)
+                if not threats or self.winning_cells(defender):
+                    continue # not forcing, or the defender wins first
+                if len(threats) > 1:
+                    return [(r, c)]
+                (br, bc), = threats
+                self.place(br, bc, defender)
+                try:
+                    line = self.find_win(attacker)
+                finally:
+                    self.remove(br, bc, defender)
+                if line is not None:
+                    return [(r, c)] + line
+            finally:
+                self.remove(r, c, attacker)
+        return None
+
+    def find_defenses(self, defender, threat_line):
+        # defender is to move and the opponent has the VCF threat_line.
+        # Returns the moves after which the opponent has no VCF.
+        attacker = other_player(defender)
+        candidates = set(threat_line)
+        candidates.update(self.winning_cells(attacker))
+        for (r, c) in threat_line:
+            self.place(r, c, attacker)
+            candidates.update(self.winning_cells(attacker))
+        for (r, c) in threat_line:
+            self.remove(r, c, attacker)
+        candidates.update(self.four_moves(defender))
+        defenses = []
+        for (r, c) in sorted(candidates):
+            if self.board[r][c] != ' ':
+                continue
+            self.place(r, c, defender)
+            try:
+                if self.find_win(attacker) is None:
+                    defenses.append((r, c))
+            finally:
+                self.remove(r, c, defender)
+        return defenses
+
+class BatchEvaluator:
+    '''static_eval for many boards in one NumPy pass.
+
+    The k-windows are precomputed as a (windows, k) array of flat cell
+    indices. A stack of boards coded 1 for X and 2 for O is gathered
+    through it, counted per window, and scored with a lookup table
+    of 10**(j-1), so all children of a node are scored by one call.
+    '''
+    def __init__(self, game_type):
+        self.game_type = game_type
+        self.windows = np.array(window_tables(game_type).windows, dtype=np.intp)
+        self.powers = np.array([0] + [10 ** j for j in range(game_type.k)], dtype=np.int64)
+
+    def encode(self, state):
+        flat = [cell for row in state.board for cell in row]
+        return np.array([1 if cell == 'X' else 2 if cell == 'O' else 0 for cell in flat],
+                        dtype=np.int8)
+
+    def scores(self, boards):
+        # boards: (B, n*m) array of coded boards. Returns B scores.
+        lines = boards[:, self.windows]
+        x = (lines == 1).sum(axis=2)
+        o = (lines == 2).sum(axis=2)
+        per_window = self.powers[x] * (o == 0) - self.powers[o] * (x == 0)
+        return per_window.sum(axis=1)
+
+    def child_scores(self, state, moves):
+        # Scores of the states after state.whose_move plays each move.
+        parent = self.encode(state)
+        boards = np.tile(parent, (len(moves), 1))
+        m = self.game_type.m
+        cells = [r * m + c for (r, c) in moves]
+        boards[np.arange(len(moves)), cells] = 1 if state.whose_move == 'X' else 2
+        return [float(score) for score in self.scores(boards).tolist()]
+
+def other_player(player):
+    return 'O' if player == 'X' else 'X'
+
+
+def board_symmetries(game_type):
+    # The symmetries of the board that keep its forbidden squares in
+    # place, as tables t with t[r][c] the cell (r, c) maps to. The identity
+    # comes first. A square board has up to 8 (rotations and reflections),
+    # any other up to 4 (the two mirror flips and the half turn).
+    n, m = game_type.n, game_type.m
+    last, last_c = n - 1, m - 1
+    maps = [lambda r, c: (r, c),
+            lambda r, c: (r, last_c - c),
+            lambda r, c: (last - r, c),
+            lambda r, c: (last - r, last_c - c)]
+    if n == m:
+        maps += [lambda r, c: (c, last - r),
+                 lambda r, c: (last - c, r),
+                 lambda r, c: (c, r),
+                 lambda r, c: (last - c, last - r)]
+    board = game_type.initial_state.board
+    symmetries = []
+    for f in maps:
+        table = [[f(r, c) for c in range(m)] for r in range(n)]
+        if all((board[r][c] == '-') == (board[table[r][c][0]][table[r][c][1]] == '-')
+               for r in range(n) for c in range(m)):
+            symmetries.append(table)
+    return symmetries
+
+class Symmetries:
+    '''The symmetries of one Game_Type's board (see board_symmetries and
+    game_symmetries), with what the agent does with them: canonical
+    hashes of positions, the symmetries a position has, and root moves
+    with mirror-image duplicates left out.
+
+    The canonical hash of a position is the smallest Zobrist hash (keys
+    from zobrist_keys, as in ZobristTable) over its images, so mirror
+    images of a position share it. The transposition table, the opening
+    book and the endgame solver all key positions by it.
+    '''
+    def __init__(self, game_type):
+        self.game_type = game_type
+        self.tables = board_symmetries(game_type)
+        self.inverses = []
+        for table in self.tables:
+            inverse = [[None] * game_type.m for _ in range(game_type.n)]
+            for r, row in enumerate(table):
+                for c, (rr, cc) in enumerate(row):
+                    inverse[rr][cc] = (r, c)
+            self.inverses.append(inverse)
+        self.piece_keys, self.side_key = zobrist_keys(game_type)
+        # move_keys[i][player][r][c]: XOR it into the hash of the image
+        # under tables[i] to have player place (or take back) a stone at
+        # (r, c); it also flips the side to move.
+        self.move_keys = [
+            {player: [[self.piece_keys[player][rr][cc] ^ self.side_key for (rr, cc) in row]
+                      for row in table]
+             for player in ('X', 'O')}
+            for table in self.tables]
+
+    def image_hashes(self, state):
+        # The Zobrist hash of the image of state under each symmetry.
+        hashes = []
+        for table in self.tables:
+            h = self.side_key if state.whose_move == 'O' else 0
+            for r, row in enumerate(state.board):
+                for c, cell in enumerate(row):
+                    if cell == 'X' or cell == 'O':
+                        rr, cc = table[r][c]
+                        h ^= self.piece_keys[cell][rr][cc]
+            hashes.append(h)
+        return hashes
+
+    def canonical_hash(self, state):
+        # (h, i): the canonical hash and the symmetry i giving it. A move
+        # (r, c) of state is tables[i][r][c] in the hash's frame.
+        hashes = self.image_hashes(state)
+        h = min(hashes)
+        return h, hashes.index(h)
+
+    def stabilizer(self, state):
+        # The symmetries, other than the identity, that map the position
+        # onto itself.
+        board = state.board
+        return [table for table in self.tables[1:]
+                if all(board[rr][cc] == cell
+                       for row, trow in zip(board, table)
+                       for cell, (rr, cc) in zip(row, trow))]
+
+    def unique_moves(self, state, moves):
+        # moves without those that some symmetry of the position maps onto
+        # an earlier move: each class of equivalent moves keeps its first.
+        stabilizer = self.stabilizer(state)
+        if not stabilizer:
+            return moves
+        seen = set()
+        unique = []
+        for (r, c) in moves:
+            if (r, c) in seen:
+                continue
+            unique.append((r, c))
+            seen.update(table[r][c] for table in stabilizer)
+        return unique
+
+_symmetries_cache = {}
+
+def game_symmetries(game_type):
+    # The Symmetries of game_type, worked out on first use.
+    symmetries = _symmetries_cache.get(game_type)
+    if symmetries is None:
+        symmetries = _symmetries_cache[game_type] = Symmetries(game_type)
+    return symmetries
+
+class OpeningBook:
+    '''Best moves for early positions of one game type, read from a file
+    written by build_opening_book.py.
+
+    Positions are keyed by their canonical hash: the smallest Zobrist
+    hash over the board's symmetries, so all mirror images and rotations
+    of a position share one entry, whose move is stored in the frame of
+    that smallest hash.
+
+    File layout: MAGIC, then n, m and the entry count (struct "<HHI"),
+    then the sorted 64-bit hashes and one byte per entry holding the
+    move's cell index r*m + c.
+    '''
+    MAGIC = b'KBOOK1'
+    HEADER = struct.Struct('<HHI')
+
+    def __init__(self, game_type):
+        self.game_type = game_type
+        self.symmetries = game_symmetries(game_type)
+        self.hashes = array('Q')
+        self.moves = b''
+
+    def canonical_hash(self, state):
+        # Returns (hash, symmetry table) for the symmetry giving the
+        # smallest hash (see Symmetries.canonical_hash).
+        h, i = self.symmetries.canonical_hash(state)
+        return h, self.symmetries.tables[i]
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(self.MAGIC):
+            raise ValueError(f"{path} is not an opening book")
+        offset = len(self.MAGIC)
+        n, m, count = self.HEADER.unpack_from(data, offset)
+        if (n, m) != (self.game_type.n, self.game_type.m):
+            raise ValueError(f"{path} is a book for a {n}x{m} board")
+        offset += self.HEADER.size
+        self.hashes = array('Q')
+        self.hashes.frombytes(data[offset:offset + 8 * count])
+        self.moves = data[offset + 8 * count:offset + 9 * count]
+
+    def save(self, path, entries):
+        # entries maps canonical hash -> move in the canonical frame.
+        m = self.game_type.m
+        keys = sorted(entries)
+        with open(path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(self.HEADER.pack(self.game_type.n, m, len(keys)))
+            f.write(array('Q', keys).tobytes())
+            f.write(bytes(entries[h][0] * m + entries[h][1] for h in keys))
+
+    def lookup(self, state):
+        # The book move for state, or None if the position is not in it.
+        if not self.hashes:
+            return None
+        h, s = self.symmetries.canonical_hash(state)
+        i = bisect_left(self.hashes, h)
+        if i == len(self.hashes) or self.hashes[i] != h:
+            return None
+        rr, cc = divmod(self.moves[i], self.game_type.m)
+        # Map the move back out of the canonical frame.
+        return self.symmetries.inverses[s][rr][cc]
+
+def _file_name(game_type):
+    # game_type's short name, made safe for a file name
+    return ''.join(ch if ch.isalnum() else '_' for ch in game_type.short_name.lower())
+
+def opening_book_path(game_type):
+    # Where build_opening_book.py writes, and prepare looks for, the book
+    # of game_type: next to this file, named after its short name.
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'opening_book_' + _file_name(game_type) + '.bin')
+
+def endgame_cache_path(game_type, directory):
+    # The EndgameSolver file of game_type in directory.
+    return os.path.join(directory, 'endgame_' + _file_name(game_type) + '.txt')
+
+def position_cache_path(game_type, directory):
+    # The PositionCache file of game_type in directory.
+    return os.path.join(directory, 'positions_' + _file_name(game_type) + '.bin')
+
+def position_cache_config(move_radius=None, use_win_detection=False):
+    # What a PositionCache's scores depend on besides the position: the
+    # static_eval version, the move radius (ALL_CELLS for none) and
+    # whether wins are detected.
+    return (EVAL_VERSION,
+            PositionCache.ALL_CELLS if move_radius is None else move_radius,
+            int(use_win_detection))
+
+
+class SearchTimeout(Exception):
+    '''Raised inside minimax once the deadline has passed. It unwinds the
+    whole search at once, so a subtree cut short never returns a value.
+    '''
+    pass
+
+# Roughly how often, in seconds, a search with a deadline reads the clock
+# (see OurAgent._poll_clock); the overrun past a deadline is about as long.
+DEADLINE_POLL_SECONDS = 0.002
+MAX_POLL_INTERVAL = 4096 # nodes
+
+
+class TimeManager:
+    '''Decides how much of each move's time limit to spend (make_move
+    with use_time_manager=True).
+
+    Every move gets a hard deadline, just short of the time limit, that
+    the search never passes, and a soft one, a share of the limit that
+    depends on the phase of the game, the turns left before the turn
+    limit and how many moves there are to choose from. Iterative
+    deepening (which the time manager turns on) starts a new iteration
+    only before the soft deadline and only if the iteration looks likely
+    to finish by the hard one, and goes no deeper than max_ply (pass
+    max_ply=None to let time alone decide). The soft deadline moves out
+    while the best move keeps changing and in once it has held for a few
+    iterations.
+    '''
+    SAFETY = 0.98
+    PHASE_SHARE = {'opening': 0.4, 'middlegame': 0.8, 'endgame': 0.6}
+    FEW_MOVES = 2          # this many candidates or fewer: nearly forced
+    FEW_MOVES_SHARE = 0.25
+    FEW_TURNS = 10         # fewer turns left than this: shallow tree
+    STABLE_ITERATIONS = 3  # best move unchanged this often: stable
+
+    def __init__(self, game_type):
+        self.game_type = game_type
+        self.initial_stones = sum(row.count('X') + row.count('O')
+                                  for row in game_type.initial_state.board)
+        self.soft_deadline = self.hard_deadline = None
+
+    def turns_left(self, state):
+        stones = sum(row.count('X') + row.count('O') for row in state.board)
+        return self.game_type.turn_limit - (stones - self.initial_stones)
+
+    # Sets the deadlines of a move started at start_time with time_limit
+    # seconds (None: the game type's default) and num_moves candidates.
+    def start(self, state, time_limit, start_time, num_moves):
+        if time_limit is None:
+            time_limit = self.game_type.default_time_per_move
+        share = self.PHASE_SHARE[game_phase(state)]
+        if num_moves <= self.FEW_MOVES:
+            share *= self.FEW_MOVES_SHARE
+        turns_left = self.turns_left(state)
+        if turns_left < self.FEW_TURNS:
+            share *= max(self.FEW_MOVES_SHARE, turns_left / self.FEW_TURNS)
+        self.start_time = start_time
+        self.time_limit = time_limit
+        self.hard_deadline = start_time + time_limit * self.SAFETY
+        self.soft_deadline = min(self.hard_deadline, start_time + time_limit * share)
+        self.last_move = None
+        self.stable = 0
+        self.iteration_times = []
+
+    # Called after each finished iteration of iterative deepening.
+    def iteration_done(self, best_move, seconds):
+        self.iteration_times.append(seconds)
+        if best_move == self.last_move:
+            self.stable += 1
+            if self.stable == self.STABLE_ITERATIONS:
+                # settled: give back half of what is left of the soft time
+                now = time.monotonic()
+                if now < self.soft_deadline:
+                    self.soft_deadline -= (self.soft_deadline - now) / 2
+        else:
+            if self.last_move is not None:
+                # still changing its mind: worth a quarter of the limit more
+                self.soft_deadline = min(self.hard_deadline,
+                                         self.soft_deadline + self.time_limit / 4)
+            self.stable = 0
+        self.last_move = best_move
+
+    # Whether to start another iteration now: before the soft deadline,
+    # and if the last one, grown by the rate the iterations grow at,
+    # would still end before the hard deadline.
+    def start_iteration(self):
+        now = time.monotonic()
+        if now >= self.soft_deadline:
+            return False
+        times = self.iteration_times
+        if not times:
+            return True
+        growth = 3.0
+        if len(times) >= 2 and times[-2] > 0:
+            growth = max(2.0, times[-1] / times[-2])
+        return now + times[-1] * growth < self.hard_deadline
+
+
+class EndgameSolver:
+    '''Exact values of late positions (make_move with use_endgame_solver=True).
+
+    A position with at most max_empty empty cells is solved by memoized
+    minimax over every way the game can still go: a stone completing k in
+    a row wins, and the game is drawn once the board is full or turn_limit
+    turns have been played (turns being the stones on the board less
+    those the game starts with, as in TimeManager). Values are on the
+    search's scale: WIN_SCORE - stones for a win by X, minus that for a
+    win by O, and 0 for a draw.
+
+    Solved positions are memoized under their canonical hash, the
+    smallest Zobrist hash over the board's symmetries, with the best move
+    in that hash's frame, so mirror images are solved once. The memo is
+    kept across turns and games and holds at most max_entries positions,
+    dropping the least recently used. With a path, each solve appends its
+    new entries to that file ("hash value cell" lines, cell r*m + c or
+    -1); the file is read back when the solver is made, and rewritten
+    without repeats or dropped entries if it has grown past the memo.
+    '''
+    MAX_EMPTY = 10
+    MAX_ENTRIES = 1 << 20
+    POLL_NODES = 1024 # read the clock this often
+
+    def __init__(self, game_type, path=None, max_empty=MAX_EMPTY, max_entries=MAX_ENTRIES):
+        self.game_type = game_type
+        self.path = path
+        self.max_empty = max_empty
+        self.max_entries = max_entries
+        self.tables = window_tables(game_type)
+        self.symmetries = game_symmetries(game_type)
+        self.initial_stones = sum(row.count('X') + row.count('O')
+                                  for row in game_type.initial_state.board)
+        # canonical hash -> (value, cell in its frame or -1), oldest first
+        self.solved = OrderedDict()
+        self.new_entries = [] # (hash, value, cell) lines not yet in the file
+        self.nodes = 0
+        self.hits = 0
+        if path is not None:
+            self.load()
+
+    def applies(self, state):
+        empty = sum(row.count(' ') for row in state.board)
+        return 0 < empty <= self.max_empty
+
+    # Returns (value, best move) for state; the move is None if the game
+    # is over. Raises SearchTimeout once deadline has passed, keeping
+    # every position solved so far.
+    def solve(self, state, deadline=None):
+        self.nodes = 0
+        self.hits = 0
+        self._deadline = deadline
+        board = [list(row) for row in state.board]
+        hashes = self.symmetries.image_hashes(state)
+        empties = [(r, c) for r, row in enumerate(board)
+                   for c, cell in enumerate(row) if cell == ' ']
+        stones = sum(row.count('X') + row.count('O') for row in board)
+        value, cell, i = self._solve(board, state.whose_move, stones, empties, hashes)
+        if cell < 0:
+            return value, None
+        # Map the move back out of the canonical frame.
+        rr, cc = divmod(cell, self.game_type.m)
+        return value, self.symmetries.inverses[i][rr][cc]
+
+    def _solve(self, board, player, stones, empties, hashes):
+        # (value, best cell in the frame of symmetry i, i)
+        h = min(hashes)
+        i = hashes.index(h)
+        entry = self.solved.get(h)
+        if entry is not None:
+            self.hits += 1
+            self.solved.move_to_end(h)
+            return entry[0], entry[1], i
+        self.nodes += 1
+        if self._deadline is not None and self.nodes % self.POLL_NODES == 0 \
+                and time.monotonic() >= self._deadline:
+            raise SearchTimeout()
+        turns = stones - self.initial_stones
+        if not empties or turns >= self.game_type.turn_limit:
+            return self._remember(h, 0, -1, i)
+        table = self.symmetries.tables[i]
+        m = self.game_type.m
+        sign = 1 if player == 'X' else -1
+        # A win now is the quickest there is.
+        for (r, c) in empties:
+            board[r][c] = player
+            won = wins_through(board, r, c, self.game_type.k)
+            board[r][c] = ' '
+            if won:
+                rr, cc = table[r][c]
+                return self._remember(h, sign * (WIN_SCORE - stones - 1), rr * m + cc, i)
+        opponent = other_player(player)
+        move_keys = self.symmetries.move_keys
+        best_value, best_move = None, None
+        for j, (r, c) in enumerate(empties):
+            board[r][c] = player
+            child_hashes = [hashes[s] ^ move_keys[s][player][r][c]
+                            for s in range(len(hashes))]
+            value = self._solve(board, opponent, stones + 1,
+                                empties[:j] + empties[j + 1:], child_hashes)[0]
+            board[r][c] = ' '
+            if best_value is None or sign * value > sign * best_value:
+                best_value, best_move = value, (r, c)
+        rr, cc = table[best_move[0]][best_move[1]]
+        return self._remember(h, best_value, rr * m + cc, i)
+
+    def _remember(self, h, value, cell, i):
+        self.solved[h] = (value, cell)
+        if len(self.solved) > self.max_entries:
+            self.solved.popitem(last=False)
+        self.new_entries.append((h, value, cell))
+        return value, cell, i
+
+    def load(self):
+        # A missing file counts as empty; unreadable lines are skipped.
+        lines = 0
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        h, value, cell = line.split()
+                        self._remember(int(h, 16), int(value), int(cell), 0)
+                    except ValueError:
+                        pass
+        except OSError:
+            pass
+        self.new_entries = []
+        if lines > len(self.solved):
+            self._compact()
+
+    def _compact(self):
+        # Rewrites the file as the memo holds it, one line per position.
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(''.join(f"{h:x} {value} {cell}\n"
+                                for h, (value, cell) in self.solved.items()))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Could not save the endgame cache:", e)
+
+    def flush(self):
+        # Appends the entries solved since the last flush to the file.
+        if self.path is None or not self.new_entries:
+            self.new_entries = []
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.write(''.join(f"{h:x} {value} {cell}\n"
+                                for h, value, cell in self.new_entries))
+        except OSError as e:
+            print("Could not save the endgame cache:", e)
+        self.new_entries = []
+
+
+class SearchProfiler:
+    '''Per-move search statistics, written to sink as one JSON line per
+    make_move: nodes and nodes per second, nodes per ply and per
+    iterative-deepening iteration, effective branching factor, time spent
+    evaluating, ordering, generating moves, copying states and making and
+    unmaking moves, TT probes and hits, and how much time was left.
+
+    sink is a file name (appended to) or an object with write(). While a
+    search runs, begin() shadows the agent's search methods with timed
+    and counted versions, and end() removes them again, so an agent
+    without a profiler runs exactly the code it always did.
+    '''
+    # Agent methods timed, and the category their time counts under. Times
+    # are exclusive: a call's time leaves out that of the timed calls
+    # inside it.
+    TIMED_METHODS = [('minimax', 'search'),
+                     ('_search_root', 'search'),
+                     ('static_eval', 'eval'),
+                     ('_ordering_scores', 'ordering'),
+                     ('_candidate_moves', 'movegen'),
+                     ('_new_child', 'copy'),
+                     ('_on_place', 'make_unmake'),
+                     ('_on_remove', 'make_unmake'),
+                     ('_threat_stage', 'threats')]
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.agent = None
+
+    def _timed(self, category, fn):
+        times = self.times
+        inner = self._inner
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            inner.append(0.0)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                times[category] += elapsed - inner.pop()
+                if inner:
+                    inner[-1] += elapsed
+        return timed
+
+    def begin(self, agent, state):
+        self.agent = agent
+        self.state = state
+        self.start = time.perf_counter()
+        self.times = dict.fromkeys([category for _name, category in self.TIMED_METHODS], 0.0)
+        self._inner = []
+        self.nodes_by_ply = {}
+        self.iterations = []
+        self.tt_probes = 0
+        for name, category in self.TIMED_METHODS:
+            setattr(agent, name, self._timed(category, getattr(agent, name)))
+
+        minimax = agent.minimax
+        nodes_by_ply = self.nodes_by_ply
+        def counted_minimax(state, depth_remaining, *args, **kwargs):
+            ply = agent._root_depth - depth_remaining
+            nodes_by_ply[ply] = nodes_by_ply.get(ply, 0) + 1
+            return minimax(state, depth_remaining, *args, **kwargs)
+        agent.minimax = counted_minimax
+
+        search_root = agent._search_root
+        def counted_search_root(state, move_list, depth, *args, **kwargs):
+            nodes = sum(nodes_by_ply.values())
+            start = time.perf_counter()
+            result = search_root(state, move_list, depth, *args, **kwargs)
+            self.iterations.append({'depth': depth,
+                                    'nodes': sum(nodes_by_ply.values()) - nodes,
+                                    'seconds': time.perf_counter() - start,
+                                    'completed': result[3]})
+            return result
+        agent._search_root = counted_search_root
+
+        self.tt = agent._tt
+        if self.tt is not None:
+            probe = self.tt.probe
+            def counted_probe(h):
+                self.tt_probes += 1
+                return probe(h)
+            self.tt.probe = counted_probe
+
+    # Takes the timed methods off the agent again and writes the record
+    # of the move just chosen; deadline is make_move's (None for none).
+    def end(self, move, deadline):
+        agent = self.agent
+        now = time.perf_counter()
+        for name, _category in self.TIMED_METHODS:
+            agent.__dict__.pop(name, None)
+        if self.tt is not None:
+            del self.tt.probe
+        self.agent = None
+
+        seconds = now - self.start
+        nodes = sum(self.nodes_by_ply.values())
+        depth = agent.completed_depth_this_turn
+        # Effective branching factor: the growth from the next-to-last to
+        # the last full iteration, or the depth-th root of all nodes.
+        done = [it for it in self.iterations if it['completed'] and it['nodes']]
+        if len(done) >= 2 and done[-1]['depth'] == done[-2]['depth'] + 1:
+            ebf = done[-1]['nodes'] / done[-2]['nodes']
+        elif depth > 0 and nodes > 0:
+            ebf = nodes ** (1.0 / depth)
+        else:
+            ebf = None
+        tt_hits = agent.zobrist_table_num_hits_this_turn
+        times = dict(self.times)
+        times['other'] = seconds - sum(times.values())
+        record = {
+            'game': agent.current_game_type.short_name if agent.current_game_type else None,
+            'side': self.state.whose_move,
+            'move': list(move) if move is not None else None,
+            'seconds': round(seconds, 6),
+            'nodes': nodes,
+            'nps': round(nodes / seconds) if seconds > 0 else None,
+            'nodes_by_ply': [self.nodes_by_ply.get(ply, 0)
+                             for ply in range(1, max(self.nodes_by_ply, default=0) + 1)],
+            'iterations': [dict(it, seconds=round(it['seconds'], 6)) for it in self.iterations],
+            'completed_depth': depth,
+            'ebf': round(ebf, 3) if ebf is not None else None,
+            'static_evals': agent.num_static_evals_this_turn,
+            'cutoffs': agent.alpha_beta_cutoffs_this_turn,
+            'times': {category: round(t, 6) for category, t in times.items()},
+            'tt_probes': self.tt_probes if self.tt is not None else None,
+            'tt_hits': tt_hits if self.tt is not None else None,
+            'tt_hit_rate': round(tt_hits / self.tt_probes, 4)
+                           if self.tt is not None and self.tt_probes else None,
+            'deadline_margin': round(deadline - time.monotonic(), 6) if deadline is not None else None,
+            'threat_nodes': agent.threat_search_nodes_this_turn,
+        }
+        self.tt = None
+        self.write(record)
+        return record
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        if hasattr(self.sink, 'write'):
+            self.sink.write(line)
+            return
+        try:
+            with open(self.sink, 'a') as f:
+                f.write(line)
+        except OSError as e:
+            print("Could not write the search profile:", e)
+
+
+class UtteranceBackend(ABC):
+    '''Where utterances come from: generate(prompt) returns one line of
+    text or raises. OurAgent calls it on a background thread, so a
+    backend may be slow, but should not hold on to shared state.
+    '''
+    @abstractmethod
+    def generate(self, prompt):
+        pass
+
+class GeminiBackend(UtteranceBackend):
+    def __init__(self, model_name="models/gemini-2.5-flash"):
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text.strip()
+
+class StubBackend(UtteranceBackend):
+    '''Local stand-in for a remote model: answers with one of lines
+    after sleeping delay seconds, so the latency cap can be exercised
+    without network access.
+    '''
+    def __init__(self, lines=("Nice move.",), delay=0.0):
+        self.lines = list(lines)
+        self.delay = delay
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return random.choice(self.lines)
+
+
+# Persona prompts. The persona fields are filled in once, in prepare
+# (see compile_prompt); the per-turn fields {board}, {status} and
+# {remark} are left for each turn. Remarks are cached and reused across
+# turns (see UtteranceCache), so they must not name the move played.
+KIM_PROMPT = """You are {persona}, a glam, dramatic, slightly mean gamer named {long_name}.
+Think Kim Kardashian energy - confident, cutting, dramatic, iconic.
+
+You MAY use or remix her classic sayings, such as:
+- I'm doing amazing, sweetie.
+- This is so embarrassing.
+- Like, literally.
+- Don't be rude.
+But DO NOT repeat the same one every turn.
+
+You're playing K-in-a-Row (like Tic Tac Toe).
+{task}
+Make it iconic, sassy, and lightly mean, like a reality TV clapback.
+Do NOT use quotation marks.
+Do NOT mention board coordinates.
+Avoid non-ASCII characters.
+"""
+
+BOB_PROMPT = """You are {persona}, a calm, kind, grounded gamer named {long_name}.
+Think Bob Ross energy - warm, peaceful, gentle, encouraging.
+
+You MAY use or adapt his classic sayings, such as:
+- Happy little accidents.
+- We don't make mistakes.
+- Let's have some fun.
+But DO NOT repeat the same one every turn.
+
+You're playing K-in-a-Row (like Tic Tac Toe).
+{task}
+Keep it warm, steady, and positive.
+Do NOT use quotation marks.
+Do NOT mention board coordinates.
+Avoid non-ASCII characters.
+"""
+
+# What is asked for on a turn of its own...
+TURN_TASK = """
+Current board:
+{board}
+
+Game update: {status}
+You just played a move.
+Your opponent said: "{remark}".
+
+Respond with EXACTLY two sentences on ONE line (max 50 words total).
+Do NOT add line breaks."""
+
+# ...and for the pool of lines made up ahead of time.
+POOL_TASK = """
+Game update: {status}
+Phase of the game: {phase}.
+
+Write {count} different remarks you could make after your move, each
+EXACTLY two sentences (max 50 words), one remark per line."""
+
+def compile_prompt(template, persona, long_name, task):
+    # template with the persona and task filled in; the per-turn fields
+    # stay as {placeholders} for str.format.
+    return template.format(persona=persona, long_name=long_name, task=task)
+
+# Game status in words, by eval score: the first bucket whose threshold
+# the score exceeds.
+GAME_STATUS = [(50, "You're winning comfortably!"),
+               (10, "You're slightly ahead."),
+               (-10, "It's pretty even right now."),
+               (-50, "You're falling behind!"),
+               (-math.inf, "You're in big trouble!")]
+NO_SCORE_STATUS = "No score info available."
+
+def eval_bucket(eval_score):
+    # Index into GAME_STATUS of eval_score (None: no score).
+    if eval_score is None:
+        return None
+    for i, (threshold, _status) in enumerate(GAME_STATUS):
+        if eval_score > threshold:
+            return i
+    return len(GAME_STATUS) - 1
+
+def game_status(bucket):
+    return NO_SCORE_STATUS if bucket is None else GAME_STATUS[bucket][1]
+
+GAME_PHASES = ('opening', 'middlegame', 'endgame')
+
+def game_phase(state):
+    # By how much of the playable board is filled.
+    empty = stones = 0
+    for row in state.board:
+        empty += row.count(' ')
+        stones += row.count('X') + row.count('O')
+    filled = stones / max(1, empty + stones)
+    if filled < 0.25:
+        return 'opening'
+    if filled < 0.6:
+        return 'middlegame'
+    return 'endgame'
+
+class UtteranceCache:
+    '''Remarks already generated, kept in least-recently-used order and
+    keyed by (persona, eval bucket, opponent-remark hash, phase); see
+    key(). Each entry is a list of lines to choose from. With a path, the
+    cache is read from that JSON file and written back whenever it
+    grows, so it carries over between runs. Backend threads add to it,
+    hence the lock; the file is written outside it, so a slow disk never
+    holds up get() on the main thread.
+    '''
+    # remark hash of the entries that hold the pre-warmed line pool
+    ANY_REMARK = -1
+
+    def __init__(self, capacity=1024, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # held while the file is written, so writes stay in order
+        self._save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.load()
+
+    @staticmethod
+    def key(persona, bucket, remark, phase):
+        # remark is hashed with crc32, which, unlike hash(), is the same
+        # from one run to the next
+        if remark is None:
+            remark_hash = UtteranceCache.ANY_REMARK
+        else:
+            remark_hash = zlib.crc32(' '.join(remark.lower().split()).encode())
+        return (persona, bucket, remark_hash, phase)
+
+    def get(self, key):
+        with self.lock:
+            lines = self.entries.get(key)
+            if lines is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return random.choice(lines)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, lines):
+        with self.lock:
+            self.entries[key] = list(lines)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+        if self.path is not None:
+            self._save()
+
+    def load(self):
+        # A missing or unreadable file counts as empty.
+        try:
+            with open(self.path) as f:
+                items = json.load(f)
+            with self.lock:
+                for key, lines in items[-self.capacity:]:
+                    self.entries[tuple(key)] = lines
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def _save(self):
+        with self._save_lock:
+            with self.lock:
+                items = [[list(key), lines] for key, lines in self.entries.items()]
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(items, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print("Could not save the utterance cache:", e)
 
 
 class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
@@ -36,8 +1491,132 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
         self.zobrist_table_num_entries_this_turn = -1
         self.zobrist_table_num_hits_this_turn = -1
         self.current_game_type = None
+        self.window_tables = None
         self.playing_mode = KAgent.DEMO
         self.return_stats = False
+        # Search profiling (see SearchProfiler): None when off, which it is
+        # unless prepare finds A4_PROFILE set to a file name.
+        self.profiler = None
+        # Transposition table, kept across turns of the same game type.
+        # _tt is the table in use for the current search (None if hashing
+        # is off) and _zobrist_hash the hash of the node being searched.
+        self.zobrist_table = None
+        self._tt = None
+        self._zobrist_hash = 0
+        # Symmetric transposition table (None if off): the hash of each
+        # image of the current node (one per symmetry of the board), the
+        # per-symmetry move keys, and _sym_frame, the symmetry whose image
+        # has the smallest hash; that smallest hash keys the table, and
+        # moves are stored in its frame.
+        self._symmetries = None
+        self._sym_hashes = None
+        self._sym_move_keys = None
+        self._sym_frame = 0
+        self._search_timed_out = False
+        # Deadline polling: minimax reads the clock only every
+        # _poll_interval nodes; _poll_countdown nodes are left until the
+        # next read, and _last_poll is the time of the last one.
+        self._poll_interval = 1
+        self._poll_countdown = 1
+        self._last_poll = 0.0
+        # Incremental static evaluator for the current search (None if off),
+        # kept in step with the node being searched.
+        self._evaluator = None
+        # The one mutable State searched in make/unmake mode (None when
+        # every node gets its own copy).
+        self._work_state = None
+        # Win detection: k to test for (None if off), stones on the board
+        # at the current node, the stone count at which the game is drawn
+        # (board full or turn_limit reached), and the (r, c, player) moves
+        # leading to the node.
+        self._win_k = None
+        self._num_stones = 0
+        self._draw_stones = 0
+        self._move_stack = []
+        # Bitboard copy of the node's position (None if off), for a win
+        # test by mask instead of by walking the board.
+        self._bitboard = None
+        # Candidate-move frontier for the current search (None: every
+        # empty cell is a candidate).
+        self._frontier = None
+        self._search_options = {}
+        # NumPy evaluator used to score all children at once for move
+        # ordering (None if off).
+        self._batch_evaluator = None
+        # Dynamic move ordering (None if off): _killers[ply] holds the last
+        # two moves that caused a cutoff at that ply, and
+        # _history[player][r][c] how often and how deep player's move to
+        # (r, c) has caused one. The history table is kept from one move
+        # to the next for its game type, with its scores halved each move.
+        self._killers = None
+        self._history = None
+        self._history_table = None
+        self._history_game_type = None
+        # Whether children are ordered by static_eval before they are
+        # searched (dynamic ordering, when on, takes its place).
+        self._order_children = True
+        # Principal variation search: whether the current search probes
+        # all but the first child with a null window, and how many probes
+        # (and aspiration windows at the root) failed and were searched again.
+        self._use_pvs = False
+        self.pvs_re_searches_this_turn = 0
+        self.aspiration_re_searches_this_turn = 0
+        # Opening book: its path is set in prepare, and the file is read
+        # the first time make_move consults it.
+        self._opening_book = None
+        self._opening_book_path = None
+        # Endgame solver (see EndgameSolver), made on first use and kept
+        # while the game type stays the same; its file is in the directory
+        # named by A4_ENDGAME_CACHE, if set.
+        self._endgame_solver = None
+        self._endgame_cache_path = None
+        self.endgame_nodes_this_turn = 0
+        # Position cache on disk (see PositionCache): mapped in prepare if
+        # A4_POSITION_CACHE names a directory. The table entries of the
+        # turns (generations) that used it go back into it at the next
+        # prepare, or at exit; each turn's search configuration is kept
+        # with its generation.
+        self.position_cache = None
+        self._position_cache_generations = {}
+        self._position_cache_at_exit = False
+        # Root-parallel search: worker processes started in prepare (if
+        # A4_SEARCH_WORKERS > 0) and whether this turn's root uses them.
+        # _turn_id counts make_move calls; a worker starts a new table
+        # turn only when the id of its task changes.
+        self._turn_id = 0
+        self.num_search_workers = 0
+        self._search_pool = None
+        self._search_pool_game_type = None
+        self._parallel_root = False
+        # Iterative-deepening bookkeeping. _pv_lines[ply] is the best line
+        # found below the node at that ply (None outside iterative
+        # deepening), _prev_pv the previous iteration's principal variation
+        # and _search_path the moves from the root to the current node.
+        self._root_depth = 0
+        self._pv_lines = None
+        self._prev_pv = []
+        self._search_path = []
+        self.completed_depth_this_turn = 0
+        self.threat_search_nodes_this_turn = 0
+        # Time management across the game (see TimeManager), made on the
+        # first make_move that asks for it.
+        self.time_manager = None
+        # Utterances: the backend asked for them (None: local lines only),
+        # the threads it runs on, the longest make_move waits for an
+        # answer before falling back on a local line, and the time it
+        # keeps back before the search's deadline for returning, in
+        # seconds.
+        self.utterance_backend = None
+        self._utterance_pool = None
+        self.utterance_latency_cap = 0.5
+        self.utterance_return_margin = 0.01
+        # Remarks already generated (see UtteranceCache), the number of
+        # lines asked for per pool entry in prepare, and the prompts,
+        # compiled in prepare.
+        self.utterance_cache = UtteranceCache()
+        self.utterance_pool_size = 5
+        self._turn_prompt = None
+        self._pool_prompt = None
 
     def introduce(self):
         name_display = self.long_name
@@ -73,6 +1652,7 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
                                       # During the tournament, this will be False..
 
         self.current_game_type = game_type
+        self.window_tables = window_tables(game_type)
         self.playing = what_side_to_play
         self.opponent_nickname = opponent_nickname
         self.time_limit = expected_time_per_move
@@ -85,16 +1665,66 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
         
         if utterances_matter:
             try:
-                self.genai_model = genai.GenerativeModel("models/gemini-2.5-flash")
+                self.utterance_backend = GeminiBackend()
                 print("Gemini model loaded successfully for utterances.")
             except Exception as e:
                 print(f"Gemini load failed: {e}")
                 print("Fallback to local utterances.")
-                self.genai_model = None
+                self.utterance_backend = None
         else:
-            self.genai_model = None
+            self.utterance_backend = None
             print("LLM disabled, using simple utterances.")
 
+        template = BOB_PROMPT if self.twin else KIM_PROMPT
+        self._turn_prompt = compile_prompt(template, self.persona, self.long_name, TURN_TASK)
+        self._pool_prompt = compile_prompt(template, self.persona, self.long_name, POOL_TASK)
+        cache_path = os.getenv("A4_UTTERANCE_CACHE") or None
+        if cache_path != self.utterance_cache.path:
+            self.utterance_cache = UtteranceCache(path=cache_path)
+        if self.utterance_backend is not None:
+            self.warm_utterance_pool()
+
+        profile_path = os.getenv("A4_PROFILE")
+        self.profiler = SearchProfiler(profile_path) if profile_path else None
+
+        # The opening book is loaded lazily, on first use.
+        if self._opening_book is None or self._opening_book.game_type is not game_type:
+            self._opening_book = None
+            self._opening_book_path = opening_book_path(game_type)
+
+        # What the last game learned goes into the position cache before
+        # the file is mapped again for this one.
+        self.save_position_cache()
+        cache_dir = os.getenv("A4_POSITION_CACHE")
+        if cache_dir:
+            path = position_cache_path(game_type, cache_dir)
+            if self.position_cache is None or self.position_cache.path != path:
+                if self.position_cache is not None:
+                    self.position_cache.close()
+                self.position_cache = PositionCache(game_type, path)
+            self.position_cache.open()
+            if not self._position_cache_at_exit:
+                atexit.register(self.save_position_cache)
+                self._position_cache_at_exit = True
+        elif self.position_cache is not None:
+            self.position_cache.close()
+            self.position_cache = None
+
+        endgame_dir = os.getenv("A4_ENDGAME_CACHE")
+        self._endgame_cache_path = endgame_cache_path(game_type, endgame_dir) if endgame_dir else None
+        solver = self._endgame_solver
+        if solver is not None and (solver.game_type is not game_type
+                                   or solver.path != self._endgame_cache_path):
+            self._endgame_solver = None
+
+        # Root-parallel search workers live for the whole game.
+        self.num_search_workers = int(os.getenv("A4_SEARCH_WORKERS", "0"))
+        if self.num_search_workers > 0:
+            self.start_search_pool(game_type)
+            print(f"Started {self.num_search_workers} search workers.")
+        else:
+            self.shutdown_search_pool()
+
         # Reset stats
         self.alpha_beta_cutoffs_this_turn = -1
         self.num_static_evals_this_turn = -1
@@ -104,114 +1734,207 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
         print("Preparation complete.")
         return "OK"
 
-    def generate_utterance(self, state, move, opponent_remark, eval_score=None):
-        board_str = "\n".join(["".join(row) for row in state.board])
-
-        # interpret the eval score into words
-        if eval_score is not None:
-            if eval_score > 50:
-                game_status = "You're winning comfortably!"
-            elif eval_score > 10:
-                game_status = "You're slightly ahead."
-            elif eval_score > -10:
-                game_status = "It's pretty even right now."
-            elif eval_score > -50:
-                game_status = "You're falling behind!"
-            else:
-                game_status = "You're in big trouble!"
-        else:
-            game_status = "No score info available."
-
-        if not self.twin:
-            prompt = f"""
-                You are {self.persona}, a glam, dramatic, slightly mean gamer named {self.long_name}.
-                Think Kim Kardashian energy—confident, cutting, dramatic, iconic.
-
-                You MAY use or remix her classic sayings, such as:
-                - I'm doing amazing, sweetie.
-                - This is so embarrassing.
-                - Like, literally.
-                - Don't be rude.
-                But DO NOT repeat the same one every turn.
-
-                You're playing K-in-a-Row (like Tic Tac Toe).
-
-                Current board:
-                {board_str}
+    def start_search_pool(self, game_type):
+        if self._search_pool is not None and self._search_pool_game_type is game_type:
+            return
+        self.shutdown_search_pool()
+        self._search_pool = ProcessPoolExecutor(
+            max_workers=self.num_search_workers,
+            initializer=_init_search_worker,
+            initargs=(game_type,))
+        self._search_pool_game_type = game_type
+        # The pool starts its processes only as tasks come in. Rounds of
+        # one task per worker start them all now, not on the first move,
+        # and run until every worker has answered.
+        started = set()
+        for _ in range(10):
+            started.update(future.result() for future in
+                           [self._search_pool.submit(_warm_search_worker)
+                            for _ in range(self.num_search_workers)])
+            if len(started) >= self.num_search_workers:
+                break
 
-                Game update: {game_status}
+    # Merges the transposition-table entries of the turns that used the
+    # position cache into its file. Only turns searched under the cache's
+    # current configuration are kept. Returns how many were written.
+    def save_position_cache(self):
+        cache, table = self.position_cache, self.zobrist_table
+        generations = {generation for generation, config
+                       in self._position_cache_generations.items()
+                       if cache is not None and config == cache.config}
+        self._position_cache_generations = {}
+        if cache is None or table is None or not generations \
+                or table.game_type is not cache.game_type:
+            return 0
+        entries = [entry for entry in table.slots
+                   if entry is not None and entry.generation in generations]
+        try:
+            return cache.merge(entries)
+        except (OSError, ValueError) as e:
+            print("Could not save the position cache:", e)
+            return 0
 
-                You just played move {move}.
-                Your opponent said: "{opponent_remark}".
+    def shutdown_search_pool(self):
+        if self._search_pool is not None:
+            self._search_pool.shutdown(cancel_futures=True)
+        self._search_pool = None
+        self._search_pool_game_type = None
+
+    # The prompt asking the backend for a remark on the move just played.
+    def _utterance_prompt(self, state, opponent_remark, eval_score=None):
+        if self._turn_prompt is None:
+            template = BOB_PROMPT if self.twin else KIM_PROMPT
+            self._turn_prompt = compile_prompt(template, self.persona, self.long_name, TURN_TASK)
+        board_str = "\n".join(["".join(row) for row in state.board])
+        return self._turn_prompt.format(board=board_str,
+                                        status=game_status(eval_bucket(eval_score)),
+                                        remark=opponent_remark)
 
-                Respond with EXACTLY two sentences on ONE line (max 50 words total).
-                Make it iconic, sassy, and lightly mean, like a reality TV clapback.
-                Do NOT use quotation marks.
-                Do NOT add line breaks.
-                Avoid non-ASCII characters.
-                """
+    # A local remark on move, used whenever the backend cannot answer.
+    def _fallback_utterance(self, move):
+        if not self.twin:
+            fallback_lines = [
+                f"My move is {move}! Not saying it's genius... but it might be",
+                f"{move} - because chaos *is* strategy.",
+                f"GG-Bot dropping {move}. Don't tilt now",
+                f"Played {move}. If this fails, blame my twin",
+                f"{move}! A bold move from a bold bot.",
+            ]
         else:
-            prompt = f"""
-                You are {self.persona}, a calm, kind, grounded gamer named {self.long_name}.
-                Think Bob Ross energy—warm, peaceful, gentle, encouraging.
-
-                You MAY use or adapt his classic sayings, such as:
-                - Happy little accidents.
-                - We don't make mistakes.
-                - Let's have some fun.
-                But DO NOT repeat the same one every turn.
-
-                You're playing K-in-a-Row (like Tic Tac Toe).
-
-                Current board:
-                {board_str}
-
-                Game update: {game_status}
-
-                You just played move {move}.
-                Your opponent said: "{opponent_remark}".
+            fallback_lines = [
+                f"Played {move}. Staying patient - strategy over impulse.",
+                f"{move}. Calm and calculated.",
+                f"Taking {move}. No rush, just control.",
+                f"{move}. Sometimes the quiet move hits hardest.",
+                f"Placed at {move}. Let's keep it steady.",
+            ]
+        return random.choice(fallback_lines)
 
-                Respond with EXACTLY two gentle sentences on ONE line (max 50 words total).
-                Keep it warm, steady, and positive.
-                Do NOT use quotation marks.
-                Do NOT add line breaks.
-                Avoid non-ASCII characters.
-                """
+    def generate_utterance(self, state, move, opponent_remark, eval_score=None):
         try:
-            if self.genai_model:
-                response = self.genai_model.generate_content(prompt)
-                return response.text.strip()
+            if self.utterance_backend:
+                return self.utterance_backend.generate(
+                    self._utterance_prompt(state, opponent_remark, eval_score))
             else:
                 # fallback if not configured
                 raise RuntimeError("Gemini not available.")
         except Exception as e:
             print("Gemini utterance generation failed:", e)
-            if not self.twin:
-                fallback_lines = [
-                    f"My move is {move}! Not saying it's genius... but it might be",
-                    f"{move} - because chaos *is* strategy.",
-                    f"GG-Bot dropping {move}. Don't tilt now",
-                    f"Played {move}. If this fails, blame my twin",
-                    f"{move}! A bold move from a bold bot.",
-                ]
-            else:
-                fallback_lines = [
-                    f"Played {move}. Staying patient - strategy over impulse.",
-                    f"{move}. Calm and calculated.",
-                    f"Taking {move}. No rush, just control.",
-                    f"{move}. Sometimes the quiet move hits hardest.",
-                    f"Placed at {move}. Let's keep it steady.",
-                ]
-            return random.choice(fallback_lines)
-   
+            return self._fallback_utterance(move)
+
+    def _submit_to_backend(self, prompt):
+        if self._utterance_pool is None:
+            # two threads, so one hung request does not block the next
+            self._utterance_pool = ThreadPoolExecutor(max_workers=2)
+            # The pool's threads are joined before atexit handlers run, so
+            # this goes in with the executor's own exit hook instead.
+            getattr(threading, '_register_atexit', atexit.register)(self.shutdown_utterance_pool)
+        return self._utterance_pool.submit(self.utterance_backend.generate, prompt)
+
+    # Drops the backend requests that have not started; one already
+    # running is left to finish on its own.
+    def shutdown_utterance_pool(self):
+        if self._utterance_pool is not None:
+            self._utterance_pool.shutdown(wait=False, cancel_futures=True)
+        self._utterance_pool = None
+
+    # Fills the cache's line pool, one entry per (eval bucket, phase) it
+    # does not have yet, in the background. Turns that miss the cache are
+    # then served from the pool instead of waiting on the backend.
+    def warm_utterance_pool(self):
+        cache = self.utterance_cache
+        for bucket in [None] + list(range(len(GAME_STATUS))):
+            for phase in GAME_PHASES:
+                key = UtteranceCache.key(self.persona, bucket, None, phase)
+                if key in cache:
+                    continue
+                prompt = self._pool_prompt.format(status=game_status(bucket), phase=phase,
+                                                  count=self.utterance_pool_size)
+                future = self._submit_to_backend(prompt)
+                future.add_done_callback(lambda f, key=key: self._cache_answer(f, key, True))
+
+    # Done-callback of a backend request: stores its answer under key,
+    # split into lines if it is a pool entry.
+    def _cache_answer(self, future, key, pool=False):
+        if future.cancelled() or future.exception() is not None:
+            return
+        text = future.result()
+        lines = [line.strip() for line in text.splitlines() if line.strip()] if pool else [text]
+        if lines:
+            self.utterance_cache.put(key, lines)
+
+    # Asks the backend for a remark on a background thread, so that a slow
+    # answer never holds up the search. Returns a Future, or None if there
+    # is no backend or the cache can answer already (await_utterance then
+    # takes the remark from there).
+    def request_utterance(self, state, move, opponent_remark, eval_score=None):
+        if self.utterance_backend is None:
+            return None
+        bucket, phase = eval_bucket(eval_score), game_phase(state)
+        key = UtteranceCache.key(self.persona, bucket, opponent_remark, phase)
+        if key in self.utterance_cache or \
+                UtteranceCache.key(self.persona, bucket, None, phase) in self.utterance_cache:
+            return None
+        future = self._submit_to_backend(
+            self._utterance_prompt(state, opponent_remark, eval_score))
+        future.add_done_callback(lambda f: self._cache_answer(f, key))
+        return future
+
+    # The remark for move: from the cache if it has one for this turn's
+    # key, else from the pool of the turn's eval bucket and phase, else
+    # the answer to the request_utterance future, waiting at most timeout
+    # seconds for it. A local line if none of these come through.
+    def await_utterance(self, future, state, move, opponent_remark, eval_score, timeout):
+        if self.utterance_backend is None:
+            return self._fallback_utterance(move)
+        cache = self.utterance_cache
+        bucket, phase = eval_bucket(eval_score), game_phase(state)
+        line = cache.get(UtteranceCache.key(self.persona, bucket, opponent_remark, phase))
+        if line is None:
+            line = cache.get(UtteranceCache.key(self.persona, bucket, None, phase))
+        if line is not None:
+            return line
+        if future is None:
+            return self._fallback_utterance(move)
+        try:
+            return future.result(timeout=max(0.0, timeout))
+        except FutureTimeoutError:
+            print("Utterance timed out; using a local line.")
+        except Exception as e:
+            print("Gemini utterance generation failed:", e)
+        return self._fallback_utterance(move)
+
     # The core of your agent's ability should be implemented here:             
     def make_move(self, current_state, current_remark, time_limit=1000,
                   use_alpha_beta=True,
                   use_zobrist_hashing=False, max_ply=3,
-                  special_static_eval_fn=None):
+                  special_static_eval_fn=None,
+                  use_iterative_deepening=False,
+                  use_incremental_eval=False,
+                  use_make_unmake=False,
+                  use_win_detection=False,
+                  move_radius=None,
+                  use_threat_search=False,
+                  use_parallel_search=False,
+                  use_opening_book=False,
+                  use_batch_eval=False,
+                  use_dynamic_ordering=False,
+                  use_pvs=False,
+                  aspiration_window=None,
+                  use_move_ordering=True,
+                  use_time_manager=False,
+                  use_symmetry=False,
+                  use_endgame_solver=False,
+                  use_position_cache=False,
+                  use_bitboards=False):
         print("make_move has been called")
         
-        start_time = time.time()
+        start_time = time.monotonic()
+        if use_time_manager and time_limit is None:
+            time_limit = self.current_game_type.default_time_per_move
+        if use_time_manager:
+            # the time manager works by deciding when to stop deepening
+            use_iterative_deepening = True
         if time_limit is None:
             deadline = None
         else:
@@ -230,108 +1953,137 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
         self.num_static_evals_this_turn = 0
         self.zobrist_table_num_entries_this_turn = -1
         self.zobrist_table_num_hits_this_turn = -1
-
+        self._turn_id += 1
+        self.completed_depth_this_turn = 0
+        self.threat_search_nodes_this_turn = 0
+        self.endgame_nodes_this_turn = 0
+        self.pvs_re_searches_this_turn = 0
+        self.aspiration_re_searches_this_turn = 0
+
+        self._begin_search(current_state,
+                           use_zobrist_hashing=use_zobrist_hashing,
+                           use_incremental_eval=use_incremental_eval,
+                           use_win_detection=use_win_detection,
+                           move_radius=move_radius,
+                           use_make_unmake=use_make_unmake,
+                           use_batch_eval=use_batch_eval,
+                           use_dynamic_ordering=use_dynamic_ordering,
+                           use_pvs=use_pvs and special_static_eval_fn is None,
+                           use_move_ordering=use_move_ordering,
+                           use_symmetry=use_symmetry,
+                           use_position_cache=use_position_cache and special_static_eval_fn is None,
+                           use_bitboards=use_bitboards)
+        self._parallel_root = (use_parallel_search and self._search_pool is not None
+                               and special_static_eval_fn is None)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin(self, current_state)
+
+        # The wrappers profiler.begin puts on the agent come off, and the
+        # search state is dropped, however the search ends.
         best_move = None
-        best_state = None
-        if current_state.whose_move == 'X':
-            best_value = -math.inf
-        else:
-            best_value = math.inf
-            
-        # Root-level alpha and beta for pruning
-        root_alpha = -math.inf
-        root_beta = math.inf
+        try:
+            # Book moves come first, then exact endgame moves; then tactics: a
+            # forced win is played at once, and if the opponent threatens one,
+            # only the moves that parry it are searched.
+            forced_move = forced_value = None
+            root_moves = None
+            if use_opening_book and special_static_eval_fn is None:
+                forced_move = self._book_move(current_state)
+            if forced_move is None and use_endgame_solver and special_static_eval_fn is None:
+                forced_move, forced_value = self._endgame_move(current_state, deadline)
+            if forced_move is None and use_threat_search and special_static_eval_fn is None:
+                forced_move, defenses = self._threat_stage(current_state, deadline)
+                if forced_move is None and len(defenses) == 1:
+                    forced_move = defenses[0]
+                elif defenses:
+                    root_moves = defenses
+            if root_moves is None:
+                root_moves = self._candidate_moves(current_state)
+            if use_symmetry:
+                # mirror images of a move already in the list score the same
+                root_moves = self._symmetries.unique_moves(current_state, root_moves)
+
+            if forced_move is not None:
+                best_move, best_state = forced_move, None
+                best_value = forced_value
+            else:
+                move_list = []
 
-        move_list = []
+                if special_static_eval_fn is None and use_move_ordering:
+                    #  ROOT-LEVEL CHILD ORDERING (one-ply static_eval)
+                    root_children = [self._new_child(current_state, r, c) for (r, c) in root_moves]
+                    scores = self._ordering_scores(current_state, root_moves, root_children)   # one-ply heuristic
+                    scored_moves = list(zip(root_moves, scores, root_children))
 
-        if special_static_eval_fn is None:
-            #  ROOT-LEVEL CHILD ORDERING (one-ply static_eval)
-            scored_moves = []
-            for r, row in enumerate(current_state.board):
-                for c, cell in enumerate(row):
-                    if cell == ' ':
-                        child = State(old=current_state)
-                        child.board[r][c] = current_state.whose_move
-                        child.change_turn()
-                        score = self.static_eval(child)   # one-ply heuristic
-                        scored_moves.append(((r, c), score, child))
+                    descending = (current_state.whose_move == 'X')  # Max wants higher first
+                    scored_moves.sort(key=lambda t: t[1], reverse=descending)
 
-            descending = (current_state.whose_move == 'X')  # Max wants higher first
-            scored_moves.sort(key=lambda t: t[1], reverse=descending)
-
-            move_list = [(move, child) for (move, _score, child) in scored_moves]
-        else:
-            #  NO ROOT ORDERING 
-            for r, row in enumerate(current_state.board):
-                for c, cell in enumerate(row):
-                    if cell == ' ':
-                        child = State(old=current_state)
-                        child.board[r][c] = current_state.whose_move
-                        child.change_turn()
+                    move_list = [(move, child) for (move, _score, child) in scored_moves]
+                else:
+                    #  NO ROOT ORDERING 
+                    for (r, c) in root_moves:
+                        child = self._new_child(current_state, r, c)
                         move_list.append(((r, c), child))
 
-        for (move, child) in move_list:
-            if deadline is not None and time.time() >= deadline:
-                print("Time's up!")
-                break
-
-            # Use shared alpha/beta across all root children
-            if use_alpha_beta:
-                value = self.minimax(
-                    child,
-                    depth_remaining=max_ply - 1,
-                    pruning=True,
-                    alpha=root_alpha,
-                    beta=root_beta,
-                    deadline=deadline,
-                    order_children=True,
-                    special_static_eval_fn=special_static_eval_fn
-                )
-
-                # update root alpha/beta for pruning at root
-                if current_state.whose_move == 'X':
-                    root_alpha = max(root_alpha, value)
+                time_manager = None
+                if use_time_manager:
+                    if self.time_manager is None or self.time_manager.game_type is not self.current_game_type:
+                        self.time_manager = TimeManager(self.current_game_type)
+                    time_manager = self.time_manager
+                    time_manager.start(current_state, time_limit, start_time, len(move_list))
+                    deadline = time_manager.hard_deadline
+
+                if use_iterative_deepening:
+                    best_value, best_move, best_state = self._iterative_deepening(
+                        current_state, move_list, deadline, max_ply,
+                        use_alpha_beta, special_static_eval_fn,
+                        aspiration_window if use_alpha_beta else None,
+                        time_manager)
                 else:
-                    root_beta = min(root_beta, value)
-            else:
-                value = self.minimax(
-                    child,
-                    depth_remaining=max_ply - 1,
-                    pruning=False,
-                    alpha=None,
-                    beta=None,
-                    deadline=deadline,
-                    order_children=True,
-                    special_static_eval_fn=special_static_eval_fn
-                )
-
-            if current_state.whose_move == 'X':
-                if best_move is None or value > best_value:
-                    best_value, best_move, best_state = value, move, child
-            else:
-                if best_move is None or value < best_value:
-                    best_value, best_move, best_state = value, move, child
-
-        
-        # If no move was chosen (time ran out or no legal moves), pick a safe default
-        if best_move is None:
-            legal_moves = [(r, c)
-                           for r, row in enumerate(current_state.board)
-                           for c, cell in enumerate(row)
-                           if cell == ' ']
-            if not legal_moves:
-                # No legal moves at all
-                return [None, "No legal moves."]
-         
-            best_move = legal_moves[0]
-            best_state = State(old=current_state)
-            r, c = best_move
-            best_state.board[r][c] = current_state.whose_move
-            best_state.change_turn()
-
-        new_remark = self.generate_utterance(
+                    best_value, best_move, best_state, completed = self._search_root(
+                        current_state, move_list, max_ply, deadline,
+                        use_alpha_beta, special_static_eval_fn)
+                    if completed:
+                        self.completed_depth_this_turn = max_ply
+
+            # If no move was chosen (time ran out or no legal moves), pick a safe default
+            if best_move is None:
+                legal_moves = [(r, c)
+                               for r, row in enumerate(current_state.board)
+                               for c, cell in enumerate(row)
+                               if cell == ' ']
+                if not legal_moves:
+                    # No legal moves at all
+                    return [None, "No legal moves."]
+
+                best_move = legal_moves[0]
+                best_state = State(old=current_state)
+                r, c = best_move
+                best_state.board[r][c] = current_state.whose_move
+                best_state.change_turn()
+            elif best_state is None:
+                # make/unmake search: build the State for the chosen move only
+                best_state = State(old=current_state)
+                r, c = best_move
+                best_state.board[r][c] = current_state.whose_move
+                best_state.change_turn()
+        finally:
+            if profiler is not None:
+                profiler.end(best_move, deadline)
+            self._end_search()
+
+        # The remark is asked for only now that the search is over, and
+        # waited for no longer than the latency cap, nor past the search's
+        # own deadline less the margin for returning.
+        utterance = self.request_utterance(
             current_state, best_move, current_remark, eval_score=best_value
         )
+        wait = self.utterance_latency_cap
+        if deadline is not None:
+            wait = min(wait, deadline - self.utterance_return_margin - time.monotonic())
+        new_remark = self.await_utterance(utterance, current_state, best_move,
+                                          current_remark, best_value, wait)
 
         inner = [best_move, best_state]
         if self.return_stats:
@@ -343,6 +2095,647 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
             ]
         return [inner, new_remark]
 
+    # Searches every root move in move_list to the given depth. Returns
+    # (best_value, best_move, best_state, completed), where completed is
+    # False if the deadline cut the search short. With alpha-beta, the
+    # root window starts at (root_alpha, root_beta).
+    def _search_root(self, current_state, move_list, depth, deadline,
+                     use_alpha_beta, special_static_eval_fn,
+                     root_alpha=-math.inf, root_beta=math.inf):
+        if self._parallel_root and move_list:
+            try:
+                return self._search_root_parallel(
+                    current_state, move_list, depth, deadline, use_alpha_beta,
+                    root_alpha, root_beta)
+            except Exception as e:
+                print("Parallel search failed, searching serially:", e)
+                self.shutdown_search_pool()
+                self._parallel_root = False
+
+        self._root_depth = depth
+        self._search_timed_out = False
+        try:
+            self._search_root_moves(current_state, move_list, depth, deadline,
+                                    use_alpha_beta, special_static_eval_fn,
+                                    root_alpha, root_beta)
+        except SearchTimeout:
+            # the root move being searched is dropped; the moves before it
+            # were searched in full
+            print("Time's up!")
+            self._search_timed_out = True
+        best_value, best_move, best_state = self._root_best
+        return best_value, best_move, best_state, not self._search_timed_out
+
+    # The loop of _search_root. Keeps the best root move so far in
+    # self._root_best, as (value, move, state), so that it survives a
+    # SearchTimeout.
+    def _search_root_moves(self, current_state, move_list, depth, deadline,
+                           use_alpha_beta, special_static_eval_fn,
+                           root_alpha, root_beta):
+        best_move = None
+        best_state = None
+        if current_state.whose_move == 'X':
+            best_value = -math.inf
+        else:
+            best_value = math.inf
+        self._root_best = (best_value, best_move, best_state)
+
+        for (move, child) in move_list:
+            if deadline is not None:
+                self._poll_countdown -= 1
+                if self._poll_countdown <= 0:
+                    self._poll_clock(deadline)
+
+            self._on_place(move[0], move[1], current_state.whose_move)
+            # taken back even if a SearchTimeout unwinds the search
+            try:
+                if child is None:
+                    child = self._work_state
+
+                # Use shared alpha/beta across all root children
+                if use_alpha_beta:
+                    value = self._search_child(
+                        child, depth - 1, current_state.whose_move == 'X',
+                        best_move is not None, root_alpha, root_beta,
+                        deadline, self._order_children, special_static_eval_fn)
+
+                    # update root alpha/beta for pruning at root
+                    if current_state.whose_move == 'X':
+                        root_alpha = max(root_alpha, value)
+                    else:
+                        root_beta = min(root_beta, value)
+                else:
+                    value = self.minimax(
+                        child,
+                        depth_remaining=depth - 1,
+                        pruning=False,
+                        alpha=None,
+                        beta=None,
+                        deadline=deadline,
+                        order_children=self._order_children,
+                        special_static_eval_fn=special_static_eval_fn
+                    )
+            finally:
+                self._on_remove(move[0], move[1], current_state.whose_move)
+
+            if current_state.whose_move == 'X':
+                improved = best_move is None or value > best_value
+            else:
+                improved = best_move is None or value < best_value
+            if improved:
+                best_value, best_move = value, move
+                best_state = child if child is not self._work_state else None
+                self._root_best = (best_value, best_move, best_state)
+                if self._pv_lines is not None:
+                    self._pv_lines[0] = [move] + self._pv_lines[1]
+
+            # failed high out of an aspiration window: the caller searches again
+            if use_alpha_beta and root_alpha >= root_beta:
+                break
+
+    # Reads the clock for minimax: raises SearchTimeout if the deadline
+    # has passed, and otherwise sets the number of nodes until the next
+    # read from the nodes per second since the last one, so that reads
+    # come about every DEADLINE_POLL_SECONDS.
+    def _poll_clock(self, deadline):
+        now = time.monotonic()
+        if now >= deadline:
+            raise SearchTimeout()
+        elapsed = now - self._last_poll
+        if elapsed > 0:
+            interval = int(self._poll_interval * DEADLINE_POLL_SECONDS / elapsed)
+            self._poll_interval = max(1, min(interval, 2 * self._poll_interval,
+                                             MAX_POLL_INTERVAL))
+        self._poll_countdown = self._poll_interval
+        self._last_poll = now
+
+    # minimax on child with the window (alpha, beta). With PVS on, a child
+    # that is not the first (first=False) is probed with a null window
+    # first and only searched again if the probe shows it may be better;
+    # the mover is X if max_play. Scores are whole numbers,
+    # so a window of width 1 is a null window.
+    def _search_child(self, child, depth_remaining, max_play, searched_first,
+                      alpha, beta, deadline, order_children, special_static_eval_fn):
+        if self._use_pvs and searched_first:
+            if max_play:
+                probe_alpha, probe_beta = alpha, alpha + 1
+            else:
+                probe_alpha, probe_beta = beta - 1, beta
+            value = self.minimax(child, depth_remaining, pruning=True,
+                                 alpha=probe_alpha, beta=probe_beta,
+                                 deadline=deadline, order_children=order_children,
+                                 special_static_eval_fn=special_static_eval_fn)
+            if not alpha < value < beta:
+                return value
+            # the probe failed high, so value bounds the child's score
+            self.pvs_re_searches_this_turn += 1
+            if max_play:
+                alpha = value
+            else:
+                beta = value
+        return self.minimax(child, depth_remaining, pruning=True,
+                            alpha=alpha, beta=beta, deadline=deadline,
+                            order_children=order_children,
+                            special_static_eval_fn=special_static_eval_fn)
+
+    # Root-parallel version of _search_root. The first root move is
+    # searched on its own; its score then bounds the searches of the other
+    # root moves, which run at the same time in the worker pool. Workers
+    # stop at the shared deadline, and their counters are added to ours;
+    # we stop waiting for them then too, and root moves not started by
+    # that time are cancelled. As in _search_root, the root window starts
+    # at (root_alpha, root_beta).
+    def _search_root_parallel(self, current_state, move_list, depth, deadline,
+                              use_alpha_beta, root_alpha=-math.inf, root_beta=math.inf):
+        player = current_state.whose_move
+        board = current_state.board
+
+        def submit(move, alpha, beta):
+            return self._search_pool.submit(
+                _search_root_move, board, player, move, depth, use_alpha_beta,
+                alpha, beta, deadline, self._search_options, self._turn_id)
+
+        def finish(futures):
+            # Waits for futures until the deadline and cancels the rest.
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait_for_futures(futures, timeout=timeout)
+            for future in pending:
+                future.cancel()
+            return done
+
+        def collect(future):
+            value, timed_out, stats = future.result()
+            cutoffs, evals, tt_entries, tt_hits = stats
+            if use_alpha_beta:
+                self.alpha_beta_cutoffs_this_turn += cutoffs
+            self.num_static_evals_this_turn += evals
+            if self._tt is not None:
+                self.zobrist_table_num_entries_this_turn += tt_entries
+                self.zobrist_table_num_hits_this_turn += tt_hits
+            return value, timed_out
+
+        if not use_alpha_beta:
+            root_alpha, root_beta = -math.inf, math.inf
+        first_move = move_list[0][0]
+        first = submit(first_move, root_alpha, root_beta)
+        if not finish([first]):
+            return None, first_move, None, False
+        best_value, timed_out = collect(first)
+        best_move = first_move
+        if timed_out:
+            return best_value, best_move, None, False
+
+        alpha, beta = root_alpha, root_beta
+        if use_alpha_beta:
+            if player == 'X':
+                alpha = max(alpha, best_value)
+            else:
+                beta = min(beta, best_value)
+        futures = [(move, submit(move, alpha, beta)) for (move, _child) in move_list[1:]]
+        done = finish([future for _move, future in futures])
+        completed = True
+        for move, future in futures:
+            if future not in done:
+                completed = False
+                continue
+            value, timed_out = collect(future)
+            if timed_out:
+                completed = False
+                continue
+            if (player == 'X' and value > best_value) or (player == 'O' and value < best_value):
+                best_value, best_move = value, move
+
+        if self._pv_lines is not None:
+            self._pv_lines[0] = [best_move]
+        return best_value, best_move, None, completed
+
+    # Search of one root move, run in a worker process: the same setup as
+    # make_move, then minimax below the move. Returns (value, timed_out,
+    # (cutoffs, static evals, TT entries, TT hits)); value is None if the
+    # deadline passed first. Tasks of one turn share its turn_id, so the
+    # table entries of earlier tasks stay as hard to replace as this one's.
+    def _search_subtree(self, state, move, depth, use_alpha_beta, alpha, beta,
+                        deadline, options, turn_id=None):
+        self.alpha_beta_cutoffs_this_turn = 0
+        self.num_static_evals_this_turn = 0
+        self.zobrist_table_num_entries_this_turn = 0
+        self.zobrist_table_num_hits_this_turn = 0
+        self._search_timed_out = False
+        if deadline is not None and time.monotonic() >= deadline:
+            # queued behind other root moves until it was too late
+            return None, True, (0, 0, 0, 0)
+        new_turn = turn_id is None or turn_id != self._turn_id
+        self._turn_id = turn_id
+        if new_turn and self.position_cache is not None:
+            # the file may have been made, or merged into, since the last move
+            self.position_cache.open()
+        self._begin_search(state, new_turn=new_turn, **options)
+        self._root_depth = depth
+        r, c = move
+        child = self._new_child(state, r, c)
+        self._on_place(r, c, state.whose_move)
+        try:
+            value = self.minimax(
+                self._work_state if child is None else child,
+                depth_remaining=depth - 1,
+                pruning=use_alpha_beta,
+                alpha=alpha if use_alpha_beta else None,
+                beta=beta if use_alpha_beta else None,
+                deadline=deadline,
+                order_children=self._order_children)
+        except SearchTimeout:
+            value = None
+            self._search_timed_out = True
+        finally:
+            self._on_remove(r, c, state.whose_move)
+        self._end_search()
+        stats = (self.alpha_beta_cutoffs_this_turn, self.num_static_evals_this_turn,
+                 self.zobrist_table_num_entries_this_turn,
+                 self.zobrist_table_num_hits_this_turn)
+        return value, self._search_timed_out, stats
+
+    # Iterative deepening: searches the root to depth 1, 2, 3, ... until
+    # the deadline and returns (best_value, best_move, best_state) from the
+    # deepest iteration that finished. Each iteration tries the previous
+    # principal variation first. Stops after max_ply (None: only the
+    # deadline or a full board stops it).
+    # With an aspiration_window, each iteration after the first searches
+    # the window of that width around the previous score, and again with
+    # the full window if the score falls outside it. A time_manager also
+    # decides whether to start each iteration after the first, and the
+    # search goes no deeper than the turns left in the game.
+    def _iterative_deepening(self, current_state, move_list, deadline, max_ply,
+                             use_alpha_beta, special_static_eval_fn,
+                             aspiration_window=None, time_manager=None):
+        max_depth = sum(row.count(' ') for row in current_state.board)
+        if max_ply is not None:
+            max_depth = min(max_depth, max_ply)
+        if time_manager is not None:
+            max_depth = max(1, min(max_depth, time_manager.turns_left(current_state)))
+
+        self._pv_lines = [[] for _ in range(max_depth + 2)]
+        self._search_path = []
+        self._prev_pv = []
+        best_value, best_move, best_state = None, None, None
+        try:
+            for depth in range(1, max_depth + 1):
+                if time_manager is not None and depth > 1 and not time_manager.start_iteration():
+                    break
+                iteration_start = time.monotonic()
+                alpha, beta = -math.inf, math.inf
+                if aspiration_window is not None and best_value is not None:
+                    alpha = best_value - aspiration_window
+                    beta = best_value + aspiration_window
+                value, move, child, completed = self._search_root(
+                    current_state, move_list, depth, deadline,
+                    use_alpha_beta, special_static_eval_fn, alpha, beta)
+                if completed and not alpha < value < beta:
+                    self.aspiration_re_searches_this_turn += 1
+                    value, move, child, completed = self._search_root(
+                        current_state, move_list, depth, deadline,
+                        use_alpha_beta, special_static_eval_fn)
+                if not completed:
+                    # Only fall back on a partial iteration if nothing finished.
+                    if best_move is None:
+                        best_value, best_move, best_state = value, move, child
+                    break
+                best_value, best_move, best_state = value, move, child
+                self.completed_depth_this_turn = depth
+                if time_manager is not None:
+                    time_manager.iteration_done(best_move, time.monotonic() - iteration_start)
+                if self._win_k is not None and abs(best_value) > WIN_SCORE // 2:
+                    break # a forced win or loss is proven; deeper won't change it
+
+                # Principal variation first in the next iteration.
+                self._prev_pv = self._pv_lines[0]
+                for i, (root_move, _child) in enumerate(move_list):
+                    if root_move == best_move:
+                        move_list.insert(0, move_list.pop(i))
+                        break
+        finally:
+            self._pv_lines = None
+            self._prev_pv = []
+        return best_value, best_move, best_state
+
+    # Set up the incremental search state for a search from state. The
+    # options are those of make_move and are kept in _search_options so
+    # that search workers can be set up the same way.
+    def _begin_search(self, current_state, use_zobrist_hashing=False,
+                      use_incremental_eval=False, use_win_detection=False,
+                      move_radius=None, use_make_unmake=False,
+                      use_batch_eval=False, use_dynamic_ordering=False,
+                      use_pvs=False, use_move_ordering=True,
+                      use_symmetry=False, use_position_cache=False,
+                      use_bitboards=False, new_turn=True):
+        self._search_options = dict(use_zobrist_hashing=use_zobrist_hashing,
+                                    use_incremental_eval=use_incremental_eval,
+                                    use_win_detection=use_win_detection,
+                                    move_radius=move_radius,
+                                    use_make_unmake=use_make_unmake,
+                                    use_batch_eval=use_batch_eval,
+                                    use_dynamic_ordering=use_dynamic_ordering,
+                                    use_pvs=use_pvs,
+                                    use_move_ordering=use_move_ordering,
+                                    use_symmetry=use_symmetry,
+                                    use_position_cache=use_position_cache,
+                                    use_bitboards=use_bitboards)
+        self._use_pvs = use_pvs
+        self._order_children = use_move_ordering
+        self.window_tables = window_tables(self.current_game_type)
+        self._tt = None
+        if use_zobrist_hashing:
+            game_type = self.current_game_type
+            if self.zobrist_table is None or self.zobrist_table.game_type is not game_type:
+                self.zobrist_table = ZobristTable(game_type)
+            self._tt = self.zobrist_table
+            if new_turn:
+                self._tt.new_turn()
+            self._tt.backing = None
+            if use_position_cache and self.position_cache is not None:
+                self.position_cache.configure(
+                    position_cache_config(move_radius, use_win_detection))
+                self._tt.backing = self.position_cache
+                self._position_cache_generations[self._tt.generation] = \
+                    self.position_cache.config
+            self._zobrist_hash = self._tt.hash_state(current_state)
+            self.zobrist_table_num_entries_this_turn = 0
+            self.zobrist_table_num_hits_this_turn = 0
+
+        self._symmetries = None
+        self._sym_hashes = None
+        if use_symmetry:
+            self._symmetries = game_symmetries(self.current_game_type)
+            if self._tt is not None and len(self._symmetries.tables) > 1:
+                # Mirror-image positions share one table entry.
+                self._sym_move_keys = self._symmetries.move_keys
+                self._sym_hashes = self._symmetries.image_hashes(current_state)
+                self._zobrist_hash = min(self._sym_hashes)
+                self._sym_frame = self._sym_hashes.index(self._zobrist_hash)
+
+        self._evaluator = None
+        if use_incremental_eval:
+            self._evaluator = IncrementalEvaluator(self.current_game_type)
+            self._evaluator.load(current_state)
+
+        self._win_k = None
+        if use_win_detection:
+            self._win_k = self.current_game_type.k
+            self._num_stones = sum(row.count('X') + row.count('O')
+                                   for row in current_state.board)
+            empty = sum(row.count(' ') for row in current_state.board)
+            initial_stones = sum(row.count('X') + row.count('O')
+                                 for row in self.current_game_type.initial_state.board)
+            self._draw_stones = min(self._num_stones + empty,
+                                    initial_stones + self.current_game_type.turn_limit)
+            self._move_stack = []
+        self._bitboard = None
+        if use_bitboards and use_win_detection:
+            self._bitboard = BitboardState.from_state(current_state)
+
+        self._poll_interval = 1
+        self._poll_countdown = 1
+        self._last_poll = time.monotonic()
+
+        self._frontier = None
+        if move_radius is not None:
+            # Only consider empty cells within move_radius of a stone.
+            self._frontier = Frontier(current_state, move_radius)
+
+        self._work_state = None
+        if use_make_unmake:
+            # Search on one mutable copy of the board, placing and taking
+            # back stones as we go; root children are not built up front.
+            self._work_state = State(old=current_state)
+
+        if use_batch_eval and np is None:
+            print("NumPy is not installed; ordering children one at a time.")
+        elif use_batch_eval:
+            if self._batch_evaluator is None or self._batch_evaluator.game_type is not self.current_game_type:
+                self._batch_evaluator = BatchEvaluator(self.current_game_type)
+        else:
+            self._batch_evaluator = None
+
+        self._killers = None
+        self._history = None
+        if use_dynamic_ordering:
+            # Below the root, children are ordered by killer moves and the
+            # history table instead of by static_eval.
+            game_type = self.current_game_type
+            self._killers = {}
+            if self._history_table is None or self._history_game_type is not game_type:
+                self._history_table = {player: [[0] * game_type.m for _ in range(game_type.n)]
+                                       for player in ('X', 'O')}
+                self._history_game_type = game_type
+            elif new_turn:
+                # older cutoffs count for less
+                for rows in self._history_table.values():
+                    for row in rows:
+                        row[:] = [score >> 1 for score in row]
+            self._history = self._history_table
+
+    # The incremental search state belongs to one search only.
+    def _end_search(self):
+        self._tt = None
+        self._bitboard = None
+        self._sym_hashes = None
+        self._evaluator = None
+        self._work_state = None
+        self._win_k = None
+        self._frontier = None
+        self._parallel_root = False
+        self._batch_evaluator = None
+        self._killers = None
+        self._history = None
+        self._use_pvs = False
+
+    # The opening book's move for state, or None. The book file is read
+    # on the first call; a missing or unreadable book counts as empty.
+    def _book_move(self, state):
+        if self._opening_book is None:
+            if self._opening_book_path is None:
+                return None
+            book = OpeningBook(self.current_game_type)
+            try:
+                book.load(self._opening_book_path)
+            except (OSError, ValueError):
+                pass
+            self._opening_book = book
+        move = self._opening_book.lookup(state)
+        if move is not None and state.board[move[0]][move[1]] != ' ':
+            return None
+        return move
+
+    # The solved move of a late position and its exact value, or (None,
+    # None) if the position has too many empty cells or the solver runs
+    # out of time; it gets half of what is left before the deadline, the
+    # search the rest.
+    def _endgame_move(self, state, deadline):
+        solver = self._endgame_solver
+        if solver is None:
+            solver = self._endgame_solver = EndgameSolver(self.current_game_type,
+                                                          self._endgame_cache_path)
+        if not solver.applies(state):
+            return None, None
+        solve_deadline = None
+        if deadline is not None:
+            now = time.monotonic()
+            solve_deadline = now + max(0.0, deadline - now) / 2
+        try:
+            value, move = solver.solve(state, solve_deadline)
+        except SearchTimeout:
+            return None, None
+        finally:
+            self.endgame_nodes_this_turn = solver.nodes
+            solver.flush()
+        return move, value
+
+    # Threat-space stage run before minimax. Returns (winning_move, []) if
+    # the side to move has a forced win by continuous fours, (None,
+    # defenses) if the opponent would have one and these moves parry it,
+    # and (None, []) otherwise or when the solver runs out of budget.
+    def _threat_stage(self, state, deadline):
+        solver = ThreatSpaceSearch(self.current_game_type)
+        solver.load(state, deadline)
+        me = state.whose_move
+        try:
+            line = solver.find_win(me)
+            if line is not None:
+                return line[0], []
+            threat = solver.find_win(other_player(me))
+            if threat is None:
+                return None, []
+            return None, solver.find_defenses(me, threat)
+        except ThreatSearchBudgetExceeded:
+            return None, []
+        finally:
+            self.threat_search_nodes_this_turn = solver.nodes
+
+    # Keep the incremental search state (hash, evaluator, path) in step
+    # with the board as player's stone at (r, c) is placed or taken back.
+    def _on_place(self, r, c, player):
+        work_state = self._work_state
+        if work_state is not None:
+            work_state.board[r][c] = player
+            work_state.change_turn()
+        if self._sym_hashes is not None:
+            self._move_symmetric_hashes(r, c, player)
+        elif self._tt is not None:
+            self._zobrist_hash ^= self._tt.move_key(r, c, player)
+        if self._evaluator is not None:
+            self._evaluator.place(r, c, player)
+        if self._frontier is not None:
+            self._frontier.place(r, c)
+        if self._pv_lines is not None:
+            self._search_path.append((r, c))
+        if self._win_k is not None:
+            self._num_stones += 1
+            self._move_stack.append((r, c, player))
+        if self._bitboard is not None:
+            self._bitboard.toggle(r, c, player)
+
+    def _on_remove(self, r, c, player):
+        work_state = self._work_state
+        if work_state is not None:
+            work_state.board[r][c] = ' '
+            work_state.change_turn()
+        if self._sym_hashes is not None:
+            self._move_symmetric_hashes(r, c, player)
+        elif self._tt is not None:
+            self._zobrist_hash ^= self._tt.move_key(r, c, player)
+        if self._evaluator is not None:
+            self._evaluator.remove(r, c, player)
+        if self._frontier is not None:
+            self._frontier.remove(r, c)
+        if self._pv_lines is not None:
+            self._search_path.pop()
+        if self._win_k is not None:
+            self._num_stones -= 1
+            self._move_stack.pop()
+        if self._bitboard is not None:
+            self._bitboard.toggle(r, c, player)
+
+    # Places or takes back player's stone at (r, c) in every image's hash,
+    # and keys the node by the smallest.
+    def _move_symmetric_hashes(self, r, c, player):
+        hashes = self._sym_hashes
+        for i, keys in enumerate(self._sym_move_keys):
+            hashes[i] ^= keys[player][r][c]
+        h = min(hashes)
+        self._zobrist_hash = h
+        self._sym_frame = hashes.index(h)
+
+    # The moves to search from state: the frontier's candidates if move
+    # generation is restricted, else every empty cell.
+    def _candidate_moves(self, state):
+        if self._frontier is not None:
+            moves = self._frontier.moves()
+            if moves:
+                return moves
+            # No stone near any empty cell (an empty board without a
+            # center, say): every empty cell is a candidate.
+        return [(r, c)
+                for r, row in enumerate(state.board)
+                for c, cell in enumerate(row)
+                if cell == ' ']
+
+    # Exact value of a decided position (only with win detection on):
+    # +/-(WIN_SCORE - stones) if the last move won, 0 for a full board or
+    # once turn_limit turns are played (as in EndgameSolver), and None if
+    # the game goes on.
+    def _terminal_value(self, state):
+        if self._move_stack:
+            r, c, player = self._move_stack[-1]
+            tables = self.window_tables
+            if self._bitboard is not None:
+                won = self._bitboard.completes_line(player, tables.cell_masks[r * tables.m + c])
+            else:
+                won = wins_through(state.board, r, c, self._win_k)
+            if won:
+                if player == 'X':
+                    return float(WIN_SCORE - self._num_stones)
+                return float(self._num_stones - WIN_SCORE)
+        if self._num_stones >= self._draw_stones:
+            return 0.0
+        return None
+
+    # One-ply scores of the children of state, for move ordering;
+    # children[i] is the state after moves[i] (None in make/unmake mode).
+    def _ordering_scores(self, state, moves, children):
+        if self._batch_evaluator is not None and moves:
+            return self._batch_evaluator.child_scores(state, moves)
+        player = state.whose_move
+        return [self._child_eval(child, r, c, player)
+                for (r, c), child in zip(moves, children)]
+
+    # The state after state.whose_move plays at (r, c), or None in
+    # make/unmake mode, where children share self._work_state.
+    def _new_child(self, state, r, c):
+        if self._work_state is not None:
+            return None
+        child = State(old=state)
+        child.board[r][c] = state.whose_move
+        child.change_turn()
+        return child
+
+    # One-ply score of child, the state after player moved to (r, c),
+    # for move ordering.
+    def _child_eval(self, child, r, c, player):
+        evaluator = self._evaluator
+        if evaluator is not None:
+            evaluator.place(r, c, player)
+            score = evaluator.score
+            evaluator.remove(r, c, player)
+            return float(score)
+        if child is not None:
+            return self.static_eval(child)
+        work_state = self._work_state
+        work_state.board[r][c] = player
+        work_state.change_turn()
+        score = self.static_eval(work_state)
+        work_state.board[r][c] = ' '
+        work_state.change_turn()
+        return score
+
     # The main adversarial search function:
     def minimax(self,
             state,
@@ -357,72 +2750,171 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
 
         default_score = 0 # Value of the passed-in state. Needs to be computed.
 
+        pv_lines = self._pv_lines
+        if pv_lines is not None:
+            ply = self._root_depth - depth_remaining
+            pv_lines[ply] = []
+
+        # decided positions: the last stone made k in a row, or the
+        # board is full or out of turns
+        if self._win_k is not None:
+            terminal_value = self._terminal_value(state)
+            if terminal_value is not None:
+                return terminal_value
+
+        # read the clock every so many nodes (see _poll_clock)
+        if deadline is not None:
+            self._poll_countdown -= 1
+            if self._poll_countdown <= 0:
+                self._poll_clock(deadline)
+
         # base case
-        if depth_remaining == 0 or (deadline is not None and time.time() >= deadline):
+        if depth_remaining == 0:
             self.num_static_evals_this_turn += 1
             if special_static_eval_fn is not None:
                 return special_static_eval_fn(state)
+            if self._evaluator is not None:
+                return float(self._evaluator.score)
             return self.static_eval(state)
 
         # set up best value
         player = state.whose_move
         max_play = (player == 'X')
 
+        # transposition table lookup: reuse a deep enough result outright,
+        # or tighten the window with a stored bound
+        tt = self._tt
+        tt_move = None
+        if tt is not None:
+            node_hash = self._zobrist_hash
+            node_frame = self._sym_frame
+            entry = tt.probe(node_hash)
+            if entry is not None:
+                self.zobrist_table_num_hits_this_turn += 1
+                tt_move = entry.best_move
+                if tt_move is not None and self._sym_hashes is not None:
+                    # stored in the frame of the smallest image
+                    tt_move = self._symmetries.inverses[node_frame][tt_move[0]][tt_move[1]]
+                if entry.depth >= depth_remaining:
+                    if entry.flag == ZobristTable.EXACT:
+                        return entry.score
+                    if pruning:
+                        if entry.flag == ZobristTable.LOWER and entry.score > alpha:
+                            alpha = entry.score
+                        elif entry.flag == ZobristTable.UPPER and entry.score < beta:
+                            beta = entry.score
+                        if alpha >= beta:
+                            return entry.score
+        window_alpha, window_beta = alpha, beta
+
         # initialize best value
         if max_play:
             best_value = -math.inf
         else:
             best_value = math.inf
+        best_move = None
 
         # build children
-        children = []
-        board = state.board
-        for r, row in enumerate(board):
-            for c, cell in enumerate(row):
-                if cell != ' ':
-                    continue
-                child = State(old=state)
-                child.board[r][c] = player
-                child.change_turn()
-                if order_children:
-                    score = self.static_eval(child)
-                    children.append(((r, c), child, score))
-                else:
-                    children.append(((r, c), child, None))
-
-        # order by heuristic if requested (Max high->low, Min low->high)
-        if order_children and children:
+        moves = self._candidate_moves(state)
+        child_states = [self._new_child(state, r, c) for (r, c) in moves]
+        history = self._history
+        if order_children and history is None:
+            scores = self._ordering_scores(state, moves, child_states)
+        else:
+            scores = [None] * len(moves)
+        children = list(zip(moves, child_states, scores))
+
+        if history is not None:
+            # dynamic ordering, with no child evaluated: this ply's
+            # killers first, then by history score
+            player_history = history[player]
+            killers = self._killers.get(self._root_depth - depth_remaining, ())
+            children.sort(key=lambda t: (t[0] in killers, player_history[t[0][0]][t[0][1]]),
+                          reverse=True)
+        elif order_children and children:
+            # order by heuristic (Max high->low, Min low->high)
             children.sort(key=lambda t: t[2], reverse=max_play)
 
+        # the best move found for this node last time is tried first
+        if tt_move is not None:
+            for i, child_info in enumerate(children):
+                if child_info[0] == tt_move:
+                    children.insert(0, children.pop(i))
+                    break
+
+        # on the previous iteration's principal variation, follow it first
+        if pv_lines is not None:
+            prev_pv = self._prev_pv
+            if ply < len(prev_pv) and self._search_path == prev_pv[:ply]:
+                for i, child_info in enumerate(children):
+                    if child_info[0] == prev_pv[ply]:
+                        children.insert(0, children.pop(i))
+                        break
+
         # recurse over children
         for (move, child, _score) in children:
-            value = self.minimax(
-                child,
-                depth_remaining=depth_remaining - 1,
-                pruning=pruning,
-                alpha=alpha,
-                beta=beta,
-                deadline=deadline,
-                order_children=order_children,
-                special_static_eval_fn=special_static_eval_fn
-            )
+            self._on_place(move[0], move[1], player)
+            # taken back even if a SearchTimeout unwinds the search, so
+            # the board, hashes and evaluator are never left mid-path
+            try:
+                if pruning:
+                    value = self._search_child(
+                        state if child is None else child,
+                        depth_remaining - 1, max_play, best_move is not None,
+                        alpha, beta, deadline, order_children, special_static_eval_fn)
+                else:
+                    value = self.minimax(
+                        state if child is None else child,
+                        depth_remaining=depth_remaining - 1,
+                        pruning=pruning,
+                        alpha=alpha,
+                        beta=beta,
+                        deadline=deadline,
+                        order_children=order_children,
+                        special_static_eval_fn=special_static_eval_fn
+                    )
+            finally:
+                self._on_remove(move[0], move[1], player)
 
             if max_play:
-                if value > best_value:
-                    best_value = value
-                if pruning:
-                    if best_value > alpha:
-                        alpha = best_value
+                improved = value > best_value
             else:
-                if value < best_value:
-                    best_value = value
-                if pruning:
-                    if best_value < beta:
-                        beta = best_value
+                improved = value < best_value
+            if improved:
+                best_value = value
+                best_move = move
+                if pv_lines is not None:
+                    pv_lines[ply] = [move] + pv_lines[ply + 1]
+
+            if pruning:
+                if max_play and best_value > alpha:
+                    alpha = best_value
+                elif not max_play and best_value < beta:
+                    beta = best_value
 
             if pruning and alpha is not None and beta is not None and alpha >= beta:
                 self.alpha_beta_cutoffs_this_turn += 1
-                return best_value
+                if history is not None:
+                    history[player][move[0]][move[1]] += depth_remaining * depth_remaining
+                    cut_ply = self._root_depth - depth_remaining
+                    killers = self._killers.get(cut_ply, [])
+                    if move not in killers:
+                        self._killers[cut_ply] = [move] + killers[:1]
+                break
+
+        if tt is not None:
+            if best_move is not None:
+                if pruning and best_value <= window_alpha:
+                    flag = ZobristTable.UPPER
+                elif pruning and best_value >= window_beta:
+                    flag = ZobristTable.LOWER
+                else:
+                    flag = ZobristTable.EXACT
+                stored_move = best_move
+                if self._sym_hashes is not None:
+                    stored_move = self._symmetries.tables[node_frame][best_move[0]][best_move[1]]
+                if tt.store(node_hash, depth_remaining, best_value, flag, stored_move):
+                    self.zobrist_table_num_entries_this_turn += 1
 
         return best_value
  
@@ -433,56 +2925,50 @@ class OurAgent(KAgent):  # Keep the class name "OurAgent" so a game master
             game_type = self.current_game_type
 
         board = state.board
-        n = len(board)
-        m = len(board[0])
         total = 0
-        k = game_type.k
+        # only windows clear of forbidden squares can be won, so only
+        # those are scored
+        for cells in window_tables(game_type).window_cells:
+            count_x = count_o = 0
+            for (r, c) in cells:
+                cell = board[r][c]
+                if cell == 'X':
+                    count_x += 1
+                elif cell == 'O':
+                    count_o += 1
+            total += window_score(count_x, count_o)
 
-         # horizontal
-        for r in range(n):
-            for c in range(m - k + 1):
-                line = [board[r][c + i] for i in range(k)]
-                total += self._score_line(line)
-
-        # vertical
-        for c in range(m):
-            for r in range(n - k + 1):
-                line = [board[r + i][c] for i in range(k)]
-                total += self._score_line(line)
-
-        # top left to bottom right
-        for r in range(n - k + 1):
-            for c in range(m - k + 1):
-                line = [board[r + i][c + i] for i in range(k)]
-                total += self._score_line(line)
-
-        # bottom left to top right
-        for r in range(k - 1, n):
-            for c in range(m - k + 1):
-                line = [board[r - i][c + i] for i in range(k)]
-                total += self._score_line(line)
-        
         return float(total)
 
-    # Helper function: to score a single line 
-    def _score_line(self, cells):
-        count_x = cells.count('X')
-        count_o = cells.count('O')
-
-        # blocked if both players appear
-        if count_x > 0 and count_o > 0:
-            return 0
-
-        # all empty: no value
-        if count_x == 0 and count_o == 0:
-            return 0
-    
-        # if only Xs
-        if count_o == 0 and count_x > 0:
-            return 10 ** (count_x - 1)
-        # if only Os
-        if count_x == 0 and count_o > 0:
-            return -(10 ** (count_o - 1))
+# Root-parallel search workers (see OurAgent._search_root_parallel). Each
+# worker process keeps one agent for the whole game, so its transposition
+# table carries over from one turn to the next.
+_worker_agent = None
+
+def _init_search_worker(game_type):
+    global _worker_agent
+    _worker_agent = OurAgent()
+    _worker_agent.current_game_type = game_type
+    _worker_agent.utterance_backend = None
+    # Workers read the position cache too (mapped again on each new move);
+    # only the main agent writes it, so what workers find is not kept.
+    cache_dir = os.getenv("A4_POSITION_CACHE")
+    if cache_dir:
+        _worker_agent.position_cache = PositionCache(game_type,
+                                                     position_cache_path(game_type, cache_dir))
+        _worker_agent.position_cache.open()
+
+def _warm_search_worker():
+    # Holds its worker briefly, so that the other tasks of the round go to
+    # the other workers. Returns the worker's process id.
+    time.sleep(0.05)
+    return os.getpid()
+
+def _search_root_move(board, whose_move, move, depth, use_alpha_beta,
+                      alpha, beta, deadline, options, turn_id):
+    state = State(initial_state_data=[board, whose_move])
+    return _worker_agent._search_subtree(state, move, depth, use_alpha_beta,
+                                         alpha, beta, deadline, options, turn_id)
 
 def test_child_ordering_variants():
     from game_types import FIAR